@@ -0,0 +1,118 @@
+import os
+import time
+import queue
+import atexit
+import threading
+from datetime import datetime
+from psycopg2.extras import execute_values
+from db import get_connection
+
+ACTIVITY_LOG_QUEUE_SIZE = int(os.getenv("ACTIVITY_LOG_QUEUE_SIZE", "10000"))
+ACTIVITY_LOG_BATCH_SIZE = int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", "500"))
+ACTIVITY_LOG_FLUSH_SECONDS = float(os.getenv("ACTIVITY_LOG_FLUSH_SECONDS", "1.0"))
+# how long log() may block on a full queue before the record is dropped
+ACTIVITY_LOG_BLOCK_SECONDS = float(os.getenv("ACTIVITY_LOG_BLOCK_SECONDS", "0.05"))
+
+
+# background sink for activity_logs. request handlers only enqueue; a worker
+# thread writes whole batches with one multi-row INSERT once the batch is
+# full or the flush interval has passed, and drains the queue on shutdown
+class ActivityLogWriter:
+    def __init__(self, maxsize=ACTIVITY_LOG_QUEUE_SIZE, batch_size=ACTIVITY_LOG_BATCH_SIZE,
+                 flush_seconds=ACTIVITY_LOG_FLUSH_SECONDS, block_seconds=ACTIVITY_LOG_BLOCK_SECONDS):
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.block_seconds = block_seconds
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.blocked = 0
+        self.flushes = 0
+        self.max_depth = 0
+
+    def _ensure_started(self):
+        # one worker thread per process, restarted after a fork
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name="activity-log-writer", daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    def log(self, activity_type, details, timestamp=None):
+        self._ensure_started()
+        record = (activity_type, details, timestamp or datetime.now())
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.blocked += 1
+            try:
+                self._queue.put(record, timeout=self.block_seconds)
+            except queue.Full:
+                self.dropped += 1
+                return False
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_seconds
+        while not self._stop.is_set() or not self._queue.empty():
+            try:
+                batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+            except queue.Empty:
+                pass
+            if len(batch) >= self.batch_size or (batch and time.monotonic() >= deadline):
+                self._flush(batch)
+                batch = []
+            if time.monotonic() >= deadline:
+                deadline = time.monotonic() + self.flush_seconds
+        if batch:
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                execute_values(cursor, """
+                               INSERT INTO activity_logs(activity_type, details, timestamp)
+                               VALUES %s
+                               """, batch, page_size=self.batch_size)
+                conn.commit()
+                cursor.close()
+            self.written += len(batch)
+            self.flushes += 1
+        except Exception as e:
+            self.failed += len(batch)
+            print(f"Logging error: {e}")
+
+    def close(self, timeout=10):
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "max_depth": self.max_depth,
+            "capacity": self._queue.maxsize,
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "flushes": self.flushes,
+            "blocked": self.blocked,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+activity_log = ActivityLogWriter()
+atexit.register(activity_log.close)
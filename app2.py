@@ -1,142 +1,223 @@
-from flask import Flask, render_template_string, request, jsonify, render_template
-import joblib
-import osmnx as ox
-import networkx as nx
-from shapely.geometry import Point, Polygon
-from util import get_eta_minutes, haversine
-import psycopg2
+from flask import Flask, render_template_string, request, jsonify, render_template, Response, stream_with_context
+from util import get_eta_minutes, haversine, haversine_many
+from eta_infer import load_eta_model
+from road_graph import load_road_graph, GRAPH_BACKEND
+from route_engine import load_route_engine, ROUTING_ENGINE
+from route_cache import RouteCache
+from routing_provider import load_routing_provider, ROUTING_PROVIDER
+from db import get_connection, db_pool
+from activity_log import activity_log
+from geocoder import load_geocoder
+from gps_ingest import position_buffer
+from driver_index import driver_index, DRIVER_CANDIDATES, LOAD_WEIGHT
+from assignment_solver import solve_assignment, greedy_assignment, UNREACHABLE_COST
+from tour_planner import TourPlanner
+from assignment_jobs import JobManager, stage, ASSIGN_SCHEDULE_SECONDS, ASSIGN_ON_NEW_DELIVERY
+from geofence_index import geofence_index, geofence_polygon, geofence_columns, polygon_coordinates, polygon_geojson, row_polygon
 import pytz
 from datetime import datetime
 from dotenv import load_dotenv
 import os
-from geopy.geocoders import OpenCage
+import time
 from haversine import haversine
 import folium
-import requests
 import json
+import numpy as np
+import atexit
+from collections import Counter
 from flask_cors import CORS
+from psycopg2.extras import execute_values
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
-model = joblib.load('model/delivery_eta_lr.pkl')
+model = load_eta_model()
 
 load_dotenv()
 
-def get_connection():
-    return psycopg2.connect(
-        host=os.getenv("DB_HOST"),
-        port=os.getenv("DB_PORT"),
-        database=os.getenv("DB_NAME"),
-        user=os.getenv("DB_USER"),
-        password=os.getenv("DB_PASSWORD")
-    )
-
 # city graph for routing
+# the csr backend maps the precompiled snapshot (python road_graph.py build),
+# which is shared between workers; GRAPH_BACKEND=networkx keeps osmnx
 print("Loading city graph...")
-try:
-    place = "Makati, Metro Manila, Philippines"
-    G = ox.graph_from_place(place, network_type="drive")
-except Exception as e:
-    print("Fallback to bbox due to error:", e)
-    north, south, east, west = 14.569, 14.535, 121.043, 121.008
-    G = ox.graph_from_bbox(north, south, east, west, network_type="drive")
+road_graph = load_road_graph(GRAPH_BACKEND)
+print(f"Loaded {GRAPH_BACKEND} graph ({road_graph.num_nodes} nodes, version {road_graph.version[:12]})")
+route_engine = load_route_engine(road_graph, ROUTING_ENGINE)
+
+# OSRM-compatible routing for assignments (ROUTING_PROVIDER=osrm|local)
+routing_provider = load_routing_provider(road_graph, route_engine, ROUTING_PROVIDER)
+
+# routes by snapped node pair, dropped whenever the graph version changes
+route_cache = RouteCache()
+warm_routes = route_cache.load(road_graph.version)
+if warm_routes:
+    print(f"Loaded {warm_routes} cached routes from {route_cache.path}")
+atexit.register(route_cache.save)
 
 # helper function
-# getting the geocode latitude and longitude of the address
-geofence_api_key = os.getenv("GEO_API_KEY")
-geolocator = OpenCage(api_key=geofence_api_key)
+# getting the geocode latitude and longitude of the address, through the
+# geocode cache (GEOCODER=opencage|fake)
+geocoder = load_geocoder()
 
 def get_lat_lng_from_address(address):
-    try:
-        location = geolocator.geocode(address)
-        if location:
-            return location.latitude, location.longitude
-        else:
-            return None, None
-    except Exception as e:
-        print(f"Geocoding error: {e}")
-        return None, None
+    return geocoder.geocode(address)
+
+# one (lat, lng) per address; uncached addresses are looked up concurrently
+def get_lat_lngs_from_addresses(addresses):
+    return geocoder.geocode_many(addresses)
     
 # logging activity
+# queued for the background writer, which batches the INSERTs
 def log_activity(activity_type, details):
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-                       INSERT INTO activity_logs(activity_type, details, timestamp)
-                       VALUES (%s, %s, %s)
-                       """, (activity_type, details, datetime.now()))
-        conn.commit()
-        cursor.close()
-        conn.close()
-    except Exception as e:
-        print(f"Logging error: {e}")
+    if not activity_log.log(activity_type, details, datetime.now()):
+        print(f"Logging error: queue full, dropped {activity_type} entry")
 
 # check geofence
+# answered from the in-memory index, which reloads itself when the table changes
 def check_geofence(lat, lng):
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT name, boundary_coordinates FROM geofences")
-        geofences = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        for name, boundary_text in geofences:
-            # Safe evaluation of polygon coordinates
-            try:
-                # Assuming boundary_coordinates is stored as string representation of list
-                poly_points = eval(boundary_text)  # Consider using json.loads for safer parsing
-                # Convert to (lng, lat) for Shapely if needed
-                poly = Polygon([(point[1], point[0]) for point in poly_points])
-                point = Point(lng, lat)
-                if poly.contains(point):
-                    return name
-            except Exception as e:
-                print(f"Error parsing geofence {name}: {e}")
-                continue
-        return None
+        return geofence_index.lookup(lat, lng)
     except Exception as e:
         print(f"Geofence check error: {e}")
         return None
 
-def suggest_route(origin, destination):
+# routes many (lat, lng) origin/destination pairs, snapping every endpoint
+# to the graph in a single call; repeated node pairs come from the cache
+def suggest_routes(origins, destinations):
+    points = list(origins) + list(destinations)
+    if not points:
+        return []
     try:
-        origin_node = ox.nearest_nodes(G, origin[1], origin[0])
-        dest_node = ox.nearest_nodes(G, destination[1], destination[0])
-        nodes = nx.shortest_path(G, origin_node, dest_node, weight='length')
-        coords = [(G.nodes[n]['y'], G.nodes[n]['x']) for n in nodes]
-        distance_m = sum(ox.utils_graph.get_route_edge_attributes(G, nodes, 'length'))
-        eta_min = distance_m / 500  # ~30km/h average speed
-        return coords, round(eta_min, 1)
+        nodes = road_graph.snap_many([p[0] for p in points], [p[1] for p in points])
     except Exception as e:
-        print(f"Route calculation error: {e}")
-        return [], 0
+        print(f"Route snapping error: {e}")
+        return [([], 0) for _ in origins]
+
+    results = []
+    for origin_node, dest_node in zip(nodes[:len(origins)], nodes[len(origins):]):
+        cached = route_cache.get("graph", origin_node, dest_node, road_graph.version)
+        if cached is not None:
+            results.append((cached["coords"], cached["eta_min"]))
+            continue
+        try:
+            path = route_engine.shortest_path(origin_node, dest_node)
+            coords = road_graph.path_coords(path)
+            distance_m = road_graph.path_length(path)
+            eta_min = round(distance_m / 500, 1)  # ~30km/h average speed
+            route_cache.put("graph", origin_node, dest_node, road_graph.version,
+                            {"coords": coords, "distance_m": distance_m, "eta_min": eta_min})
+            results.append((coords, eta_min))
+        except Exception as e:
+            print(f"Route calculation error: {e}")
+            results.append(([], 0))
+    return results
+
+def suggest_route(origin, destination):
+    return suggest_routes([origin], [destination])[0]
+
+# provider legs for each list of (lat, lng) waypoints: None for legs with no
+# route, or the exception if the request failed. cached legs are reused,
+# keyed by the provider's cache_keys (graph nodes for the local provider,
+# rounded coordinates for OSRM); each list with a missing leg costs one
+# multi-waypoint request, and those requests are sent concurrently
+def route_legs_many(point_lists):
+    flat = [p for points in point_lists for p in points]
+    if not flat:
+        return [[] for _ in point_lists]
+    keys = routing_provider.cache_keys(flat)
+
+    results, pending, offset = [], [], 0
+    for points in point_lists:
+        leg_keys = [(keys[offset + k], keys[offset + k + 1]) for k in range(len(points) - 1)]
+        offset += len(points)
+        legs = [route_cache.get(routing_provider.name, o, d, road_graph.version) for o, d in leg_keys]
+        if any(leg is None for leg in legs):
+            pending.append((len(results), points, leg_keys))
+        results.append(legs)
+
+    responses = routing_provider.route_many([points for _, points, _ in pending])
+    for (index, points, leg_keys), resp in zip(pending, responses):
+        if resp.get("code") == "Error":
+            results[index] = RuntimeError(resp.get("message"))
+            continue
+        if not resp.get("routes"):
+            results[index] = [None] * len(leg_keys)
+            continue
+        legs = [{key: leg[key] for key in ("duration", "distance", "geometry")} for leg in resp["routes"][0]["legs"]]
+        for (o, d), leg in zip(leg_keys, legs):
+            route_cache.put(routing_provider.name, o, d, road_graph.version, leg)
+        results[index] = legs
+    return results
+
+def route_legs(points):
+    legs = route_legs_many([points])[0]
+    if isinstance(legs, Exception):
+        raise legs
+    return legs
+
+# network travel time in minutes from every origin to every destination,
+# one /table-style matrix call on the routing provider
+def travel_time_matrix(origins, destinations):
+    return routing_provider.table(list(origins), list(destinations)) / 60
 
-def assign_driver_to_order(delivery_id, pickup_lat, pickup_lng):
+# minutes for several (origins, destinations) tables in one go
+def travel_time_tables(tables):
+    return [t / 60 for t in routing_provider.table_many([(list(o), list(d)) for o, d in tables])]
+
+# cost of sending a driver row (driver_id, name, lat, lng, load) to a pickup.
+# travel_min maps driver_id -> network minutes to the pickup for every driver
+# being compared (see scored_minutes), or is None to compare them all on
+# straight-line distance
+def driver_cost(driver, pickup_lat, pickup_lng, travel_min=None):
+    if travel_min and driver[0] in travel_min:
+        distance_km = travel_min[driver[0]] / 2  # back to km at ~30km/h, keeps the load weight
+    else:
+        distance_km = haversine((driver[2], driver[3]), (pickup_lat, pickup_lng))
+    return distance_km + (driver[4] * LOAD_WEIGHT)  # Weight load more
+
+# candidates are the drivers from driver_index that travel_min times. the
+# index can lag behind other workers, so they are re-read from the table,
+# and if none is still free all available drivers are scanned and compared
+# on straight-line distance alone.
+# the delivery and the drivers are claimed with SKIP LOCKED, so concurrent
+# assigners never pick the same row: returns False when another worker
+# holds the delivery and None when no driver is free
+def assign_driver_to_order(delivery_id, pickup_lat, pickup_lng, candidates, travel_min=None):
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT driver_id, name, current_lat, current_lng, current_load FROM drivers WHERE availability = TRUE")
-        drivers = cursor.fetchall()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT delivery_id FROM deliveries
+                WHERE delivery_id = %s AND assigned_driver_id IS NULL AND status = 'pending'
+                FOR UPDATE SKIP LOCKED
+                """, (delivery_id,))
+            if cursor.fetchone() is None:
+                cursor.close()
+                return False
+            drivers = claim_drivers(cursor, [d[0] for d in candidates])
+            if not drivers:
+                cursor.execute("""
+                    SELECT driver_id, name, current_lat, current_lng, current_load FROM drivers
+                    WHERE availability = TRUE
+                    FOR UPDATE SKIP LOCKED
+                    """)
+                drivers = cursor.fetchall()
+                travel_min = None
         
-        if not drivers:
-            cursor.close()
-            conn.close()
-            return None
+            if not drivers:
+                cursor.close()
+                return None
             
-        # Find closest driver considering both distance and current load
-        best_driver = min(drivers, key=lambda d: haversine((d[2], d[3]), (pickup_lat, pickup_lng)) + (d[4] * 2))  # Weight load more
-        driver_id = best_driver[0]
-        
-        # increment load
-        cursor.execute("UPDATE drivers SET current_load = current_load + 1, availability = FALSE WHERE driver_id=%s", (driver_id,))
-        # assign driver to delivery
-        cursor.execute("UPDATE deliveries SET assigned_driver_id=%s, status='assigned', updated_at=%s WHERE delivery_id=%s", (driver_id, datetime.now(), delivery_id))
-        conn.commit()
-        cursor.close()
-        conn.close()
+            # Find closest driver considering both distance and current load
+            best_driver = min(drivers, key=lambda d: driver_cost(d, pickup_lat, pickup_lng, travel_min))
+            driver_id = best_driver[0]
+        
+            # increment load
+            cursor.execute("UPDATE drivers SET current_load = current_load + 1, availability = FALSE WHERE driver_id=%s", (driver_id,))
+            # assign driver to delivery
+            cursor.execute("UPDATE deliveries SET assigned_driver_id=%s, status='assigned', updated_at=%s WHERE delivery_id=%s", (driver_id, datetime.now(), delivery_id))
+            conn.commit()
+            cursor.close()
+        driver_index.update(driver_id, load_delta=1, available=False)
         
         log_activity("assign_driver", f"Assigned delivery {delivery_id} to driver {best_driver[1]}")
         return {
@@ -149,31 +230,493 @@ def assign_driver_to_order(delivery_id, pickup_lat, pickup_lng):
         print(f"Driver assignment error: {e}")
         return None
 
+# locks the available drivers among driver_ids for this transaction, skipping
+# the ones another worker has claimed
+def claim_drivers(cursor, driver_ids):
+    if not driver_ids:
+        return []
+    cursor.execute("""
+        SELECT driver_id, name, current_lat, current_lng, current_load FROM drivers
+        WHERE availability = TRUE AND driver_id = ANY(%s)
+        ORDER BY driver_id
+        FOR UPDATE SKIP LOCKED
+        """, (list(driver_ids),))
+    return cursor.fetchall()
+
+# deliveries an assignment run is working on, in the assignment_claims table
+# from migrate_assignment_claims.py. a claim is a lease rather than a row
+# lock, so nothing stays locked while routes are requested, and it runs out
+# by itself if the worker dies mid-run
+ASSIGN_CLAIM_LEASE_SECONDS = float(os.getenv("ASSIGN_CLAIM_LEASE_SECONDS", "300"))
+
+# leases up to limit pending deliveries after after_id in a short
+# transaction. rows another run holds, by lease or by lock, are skipped, so
+# concurrent runs split the backlog between them. returns the claimed rows
+# and the last delivery id looked at, for the next call
+def claim_deliveries(after_id, limit):
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT d.delivery_id, d.pickup_lat, d.pickup_lng, d.dropoff_lat, d.dropoff_lng
+            FROM deliveries d
+            WHERE d.assigned_driver_id IS NULL AND d.status = 'pending' AND d.delivery_id > %s
+              AND NOT EXISTS (SELECT 1 FROM assignment_claims c
+                              WHERE c.delivery_id = d.delivery_id AND c.claimed_until > NOW())
+            ORDER BY d.delivery_id
+            LIMIT %s
+            FOR UPDATE OF d SKIP LOCKED
+            """, (after_id, limit))
+        rows = cursor.fetchall()
+        claimed = set()
+        if rows:
+            # the conditional upsert settles two runs racing for the same row
+            claimed = {row[0] for row in execute_values(cursor, """
+                INSERT INTO assignment_claims(delivery_id, claimed_until)
+                VALUES %s
+                ON CONFLICT (delivery_id) DO UPDATE SET claimed_until = EXCLUDED.claimed_until
+                WHERE assignment_claims.claimed_until <= NOW()
+                RETURNING delivery_id
+                """, [(row[0], ASSIGN_CLAIM_LEASE_SECONDS) for row in rows],
+                template="(%s, NOW() + make_interval(secs => %s))", fetch=True)}
+        conn.commit()
+        cursor.close()
+    return [row for row in rows if row[0] in claimed], (rows[-1][0] if rows else after_id)
+
+def release_claims(delivery_ids):
+    if not delivery_ids:
+        return
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM assignment_claims WHERE delivery_id = ANY(%s)", (list(delivery_ids),))
+        conn.commit()
+        cursor.close()
+
+# eta, distance and waypoints of a driver -> pickup -> dropoff trip from its
+# two provider legs
+def summarize_trip(leg_to_pickup, leg_to_dropoff):
+    #eta
+    eta_to_pickup = leg_to_pickup["duration"] / 60
+    eta_delivery = leg_to_dropoff["duration"] / 60
+    total_eta = eta_to_pickup + eta_delivery
+
+    #route
+    route_to_pickup = leg_to_pickup["geometry"]["coordinates"]
+    route_to_dropoff = leg_to_dropoff["geometry"]["coordinates"]
+    full_route = [f"{lat},{lng}" for lat, lng in route_to_pickup + route_to_dropoff[1:]]
+
+    #distance
+    distance_to_pickup = leg_to_pickup["distance"] / 1000  # Convert to km
+    distance_delivery = leg_to_dropoff["distance"] / 1000  # Convert to km
+    total_distance = distance_to_pickup + distance_delivery
+    return total_eta, total_distance, full_route
+
+ASSIGN_CHUNK_SIZE = int(os.getenv("ASSIGN_CHUNK_SIZE", "500"))
+
+# set-based assignment: every pick happens in memory and all writes go out
+# as a few batched statements in one transaction. candidates come from
+# driver_index, skipping drivers already picked in this batch. deliveries
+# without a route stay pending and keep their driver free
+def assign_deliveries_bulk(deliveries, travel_min, chunk_size=ASSIGN_CHUNK_SIZE):
+    picks, taken = [], set()
+    for delivery in deliveries:
+        delivery_id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng = delivery
+        if check_geofence(pickup_lat, pickup_lng) or check_geofence(dropoff_lat, dropoff_lng):
+            log_activity("geofence_violation", f"Delivery {delivery_id} inside geofence, skipped")
+            continue
+        candidates = driver_index.nearest(pickup_lat, pickup_lng, DRIVER_CANDIDATES, exclude=taken)
+        if not candidates:
+            log_activity("assignment_failed", f"No available driver for delivery {delivery_id}")
+            continue
+        minutes = scored_minutes(delivery, candidates, travel_min)
+        driver = min(candidates, key=lambda d: driver_cost(d, pickup_lat, pickup_lng, minutes))
+        taken.add(driver[0])
+        picks.append((delivery, driver))
+    return commit_assignments(picks, chunk_size)
+
+# routes every (delivery, driver row) pick and writes the routed ones with
+# batched statements in one transaction
+def commit_assignments(picks, chunk_size=ASSIGN_CHUNK_SIZE):
+    waypoints = [[(driver[2], driver[3]), (d[1], d[2]), (d[3], d[4])] for d, driver in picks]
+    try:
+        with stage("routing"):
+            all_legs = route_legs_many(waypoints)
+    except Exception as e:
+        all_legs = [e] * len(picks)
+
+    delivery_rows, route_rows, response = [], [], []
+    for (delivery, driver), legs in zip(picks, all_legs):
+        delivery_id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng = delivery
+        if isinstance(legs, Exception):
+            log_activity("route_error", f"{routing_provider.name} request failed for delivery {delivery_id}: {legs}")
+            continue
+        if not (legs[0] and legs[1]):
+            log_activity("route_error", f"{routing_provider.name} no route for delivery {delivery_id}")
+            continue
+        total_eta, total_distance, full_route = summarize_trip(*legs)
+        delivery_rows.append((delivery_id, driver[0], total_eta))
+        route_rows.append((delivery_id, full_route, total_distance, total_eta))
+        response.append({
+             "delivery_id": delivery_id,
+             "pickup_lat": pickup_lat,
+             "pickup_lng": pickup_lng,
+             "dropoff_lat": dropoff_lat,
+             "dropoff_lng": dropoff_lng,
+             "driver_id": driver[0],
+             "driver_name": driver[1],
+             "eta_minutes": total_eta,
+             "route_coordinates": full_route
+        })
+
+    with stage("write"):
+        written = write_assignments(delivery_rows, route_rows, chunk_size)
+    response = [item for item in response if item["delivery_id"] in written]
+    for item in response:
+        log_activity("assign_driver", f"Assigned delivery {item['delivery_id']} to driver {item['driver_name']}")
+    return response
+
+# the batched writes behind bulk, optimal and tours modes, in one short
+# transaction. delivery_rows are (delivery_id, driver_id, eta) and route_rows
+# go to routes as-is. the picks were made on unlocked reads, so the rows are
+# locked and checked here first: deliveries no longer pending and drivers
+# another worker has taken (or holds) are dropped and stay for the next run.
+# returns the ids of the deliveries written
+def write_assignments(delivery_rows, route_rows, chunk_size=ASSIGN_CHUNK_SIZE):
+    if not delivery_rows:
+        return set()
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        # deliveries first and waiting, drivers after without waiting, so this
+        # never waits while holding a driver
+        cursor.execute("""
+            SELECT delivery_id FROM deliveries
+            WHERE delivery_id = ANY(%s) AND assigned_driver_id IS NULL AND status = 'pending'
+            ORDER BY delivery_id
+            FOR UPDATE
+            """, ([row[0] for row in delivery_rows],))
+        pending = {row[0] for row in cursor.fetchall()}
+        free = {row[0] for row in claim_drivers(cursor, {row[1] for row in delivery_rows})}
+        for delivery_id, driver_id, _ in delivery_rows:
+            if delivery_id in pending and driver_id not in free:
+                log_activity("assignment_failed", f"Driver {driver_id} was taken before delivery {delivery_id} was written")
+        delivery_rows = [row for row in delivery_rows if row[0] in pending and row[1] in free]
+        written = {row[0] for row in delivery_rows}
+        route_rows = [row for row in route_rows if row[0] in written]
+        driver_loads = list(Counter(row[1] for row in delivery_rows).items())
+        if not delivery_rows:
+            conn.rollback()
+            cursor.close()
+            return written
+        execute_values(cursor, """
+            UPDATE deliveries
+            SET assigned_driver_id = v.driver_id, status = 'assigned', eta_minutes = v.eta, updated_at = NOW()
+            FROM (VALUES %s) AS v(delivery_id, driver_id, eta)
+            WHERE deliveries.delivery_id = v.delivery_id
+            """, delivery_rows, page_size=chunk_size)
+        execute_values(cursor, """
+            UPDATE drivers
+            SET current_load = current_load + v.added, availability = FALSE
+            FROM (VALUES %s) AS v(driver_id, added)
+            WHERE drivers.driver_id = v.driver_id
+            """, driver_loads, page_size=chunk_size)
+        execute_values(cursor, """
+            INSERT INTO routes(delivery_id, waypoints, distance_km, duration_minutes)
+            VALUES %s
+            """, route_rows, page_size=chunk_size)
+        conn.commit()
+        cursor.close()
+    for driver_id, added in driver_loads:
+        driver_index.update(driver_id, load_delta=added, available=False)
+    return written
+
+# deliveries whose pickup and dropoff are both outside every geofence, with
+# one vectorized index lookup per side
+def outside_geofences(deliveries):
+    try:
+        with stage("geofence"):
+            pickup_gf = geofence_index.lookup_many([d[1] for d in deliveries], [d[2] for d in deliveries])
+            dropoff_gf = geofence_index.lookup_many([d[3] for d in deliveries], [d[4] for d in deliveries])
+    except Exception as e:
+        print(f"Geofence check error: {e}")
+        pickup_gf = dropoff_gf = [None] * len(deliveries)
+    allowed = []
+    for delivery, pickup_zone, dropoff_zone in zip(deliveries, pickup_gf, dropoff_gf):
+        if pickup_zone or dropoff_zone:
+            log_activity("geofence_violation", f"Delivery {delivery[0]} inside geofence, skipped")
+        else:
+            allowed.append(delivery)
+    return allowed
+
+# driver_cost for every delivery x driver pair. a delivery with road times
+# is priced on those alone, its other drivers get UNREACHABLE_COST, since
+# straight-line km would undercut any road time. straight-line km only
+# prices deliveries that have no road times at all
+def delivery_cost_matrix(deliveries, drivers, travel_min):
+    pickup_lat = np.array([d[1] for d in deliveries], dtype=np.float64)[:, None]
+    pickup_lng = np.array([d[2] for d in deliveries], dtype=np.float64)[:, None]
+    driver_lat = np.array([d[2] for d in drivers], dtype=np.float64)[None, :]
+    driver_lng = np.array([d[3] for d in drivers], dtype=np.float64)[None, :]
+    loads = np.array([d[4] or 0 for d in drivers], dtype=np.float64)[None, :]
+    cost = haversine_many(pickup_lat, pickup_lng, driver_lat, driver_lng) + loads * LOAD_WEIGHT
+    column = {d[0]: j for j, d in enumerate(drivers)}
+    for i, delivery in enumerate(deliveries):
+        minutes = travel_min.get(delivery[0])
+        if not minutes:
+            continue
+        cost[i] = UNREACHABLE_COST
+        for driver_id, m in minutes.items():
+            if driver_id in column:
+                j = column[driver_id]
+                cost[i, j] = m / 2 + loads[0, j] * LOAD_WEIGHT
+    return cost
+
+# globally optimal assignment: one min-cost matching over all deliveries x
+# drivers instead of first come, first served. with more deliveries than
+# drivers the oldest ones are matched. returns the assignments and the
+# matching's total cost next to what greedy picking would have cost
+def assign_deliveries_optimal(deliveries, drivers, travel_min, chunk_size=ASSIGN_CHUNK_SIZE):
+    # with road times only their drivers can be matched, which also keeps
+    # the matrix to deliveries x candidates however many drivers are free
+    if travel_min:
+        timed = {driver_id for minutes in travel_min.values() for driver_id in minutes}
+        drivers = [d for d in drivers if d[0] in timed]
+    allowed = sorted(outside_geofences(deliveries))[:len(drivers)]
+
+    with stage("matching"):
+        cost = delivery_cost_matrix(allowed, drivers, travel_min)
+        rows, cols = solve_assignment(cost)
+        greedy_rows, greedy_cols = greedy_assignment(cost)
+    summary = {
+        "matched": len(rows),
+        "total_cost": round(float(cost[rows, cols].sum()), 3),
+        "greedy_matched": len(greedy_rows),
+        "greedy_cost": round(float(cost[greedy_rows, greedy_cols].sum()), 3),
+    }
+
+    matched = set(rows.tolist())
+    for i, delivery in enumerate(allowed):
+        if i not in matched:
+            log_activity("assignment_failed", f"No available driver for delivery {delivery[0]}")
+    picks = [(allowed[i], drivers[j]) for i, j in zip(rows, cols)]
+    return commit_assignments(picks, chunk_size), summary
+
+# multi-stop tours: pending deliveries are bundled into one ordered pickup
+# and dropoff sequence per driver by TourPlanner, over travel times between
+# every candidate driver, pickup and dropoff. a delivery's eta and route run
+# from the driver's start to its dropoff along the tour
+def assign_deliveries_tours(deliveries, chunk_size=ASSIGN_CHUNK_SIZE):
+    allowed = outside_geofences(deliveries)
+    candidate_rows = [driver_index.nearest(d[1], d[2], DRIVER_CANDIDATES) for d in allowed]
+    tour_drivers = list({c[0]: c for cs in candidate_rows for c in cs}.values())
+    if not allowed or not tour_drivers:
+        for delivery in allowed:
+            log_activity("assignment_failed", f"No available driver for delivery {delivery[0]}")
+        return [], {"tours": [], "unassigned": len(allowed)}
+    column = {d[0]: j for j, d in enumerate(tour_drivers)}
+    candidates = [[column[c[0]] for c in cs] for cs in candidate_rows]
+
+    points = ([(d[2], d[3]) for d in tour_drivers] + [(d[1], d[2]) for d in allowed] +
+              [(d[3], d[4]) for d in allowed])
+    # insertion only looks at a driver's own position and the stops of
+    # deliveries that list it as a candidate, so one table per driver over
+    # those nodes is all the planner reads. other entries stay inf
+    first_pickup, first_dropoff = len(tour_drivers), len(tour_drivers) + len(allowed)
+    shared = [[] for _ in tour_drivers]
+    for k, cs in enumerate(candidates):
+        for j in cs:
+            shared[j].append(k)
+    node_groups = [[j] + [first_pickup + k for k in ks] + [first_dropoff + k for k in ks] for j, ks in enumerate(shared) if ks]
+    try:
+        with stage("travel_matrix"):
+            tables = travel_time_tables([([points[n] for n in nodes], [points[n] for n in nodes[1:]])
+                                         for nodes in node_groups])
+            times = np.full((len(points), len(points)), np.inf)
+            for nodes, table in zip(node_groups, tables):
+                times[np.ix_(nodes, nodes[1:])] = table
+    except Exception as e:
+        print(f"Travel time matrix error: {e}")
+        lats = np.array([p[0] for p in points])[:, None]
+        lngs = np.array([p[1] for p in points])[:, None]
+        times = haversine_many(lats, lngs, lats.T, lngs.T) * 2  # ~30km/h average speed
+
+    started = datetime.now()
+    with stage("planning"):
+        planner = TourPlanner(times, len(tour_drivers), len(allowed), candidates)
+        planner.plan()
+    planning_ms = round((datetime.now() - started).total_seconds() * 1000, 1)
+    unassigned = planner.unassigned()
+    for k in unassigned:
+        log_activity("assignment_failed", f"No feasible tour for delivery {allowed[k][0]}")
+
+    tours = [(j, stops) for j, stops in enumerate(planner.routes) if stops]
+    waypoints = [[points[j]] + [points[node] for node in stops] for j, stops in tours]
+    try:
+        with stage("routing"):
+            all_legs = route_legs_many(waypoints)
+    except Exception as e:
+        all_legs = [e] * len(tours)
+
+    delivery_rows, route_rows, response, tour_list = [], [], [], []
+    for (j, stops), legs in zip(tours, all_legs):
+        driver = tour_drivers[j]
+        tour_deliveries = [allowed[planner.delivery(node)][0] for node in stops if planner.is_pickup(node)]
+        if isinstance(legs, Exception) or not all(legs):
+            log_activity("route_error", f"{routing_provider.name} no route for tour of driver {driver[0]} "
+                                        f"(deliveries {tour_deliveries}): {legs if isinstance(legs, Exception) else 'missing leg'}")
+            continue
+        eta, distance, coords, stop_list = 0.0, 0.0, [], []
+        for node, leg in zip(stops, legs):
+            eta += leg["duration"] / 60
+            distance += leg["distance"] / 1000
+            coords += leg["geometry"]["coordinates"][1 if coords else 0:]
+            delivery = allowed[planner.delivery(node)]
+            stop_list.append({"delivery_id": delivery[0], "type": "pickup" if planner.is_pickup(node) else "dropoff",
+                              "eta_minutes": eta})
+            if planner.is_pickup(node):
+                continue
+            full_route = [f"{lat},{lng}" for lat, lng in coords]
+            delivery_rows.append((delivery[0], driver[0], eta))
+            route_rows.append((delivery[0], full_route, distance, eta))
+            response.append({
+                 "delivery_id": delivery[0],
+                 "pickup_lat": delivery[1],
+                 "pickup_lng": delivery[2],
+                 "dropoff_lat": delivery[3],
+                 "dropoff_lng": delivery[4],
+                 "driver_id": driver[0],
+                 "driver_name": driver[1],
+                 "eta_minutes": eta,
+                 "route_coordinates": full_route
+            })
+        tour_list.append({"driver_id": driver[0], "driver_name": driver[1], "stops": stop_list,
+                          "duration_minutes": eta, "distance_km": distance})
+
+    with stage("write"):
+        written = write_assignments(delivery_rows, route_rows, chunk_size)
+    response = [item for item in response if item["delivery_id"] in written]
+    tour_list = [tour for tour in tour_list if tour["driver_id"] in {item["driver_id"] for item in response}]
+    for tour in tour_list:
+        delivery_ids = [stop["delivery_id"] for stop in tour["stops"] if stop["type"] == "dropoff"]
+        log_activity("assign_driver", f"Assigned deliveries {delivery_ids} to driver {tour['driver_name']} as one tour")
+    return response, {"tours": tour_list, "unassigned": len(unassigned), "planning_ms": planning_ms,
+                      "local_search_moves": planner.moves}
+
+# per-delivery assignment: each pick is committed on its own, then every
+# route is fetched at once and written delivery by delivery
+def assign_deliveries_greedy(deliveries, travel_min):
+    response = []
+    # pick drivers first, then fetch every route at once so the provider
+    # requests overlap instead of running one after another
+    assigned = []
+    for delivery in deliveries:
+        delivery_id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng = delivery
+
+        # Check geofences
+        if check_geofence(pickup_lat, pickup_lng) or check_geofence(dropoff_lat, dropoff_lng):
+            log_activity("geofence_violation", f"Delivery {delivery_id} inside geofence, skipped")
+            continue
+
+        # Assign nearest **available** driver
+        candidates = driver_index.nearest(pickup_lat, pickup_lng, DRIVER_CANDIDATES)
+        minutes = scored_minutes(delivery, candidates, travel_min)
+        driver = assign_driver_to_order(delivery_id, pickup_lat, pickup_lng, candidates, minutes)
+        if driver is False:
+            # claimed by a concurrent assigner
+            continue
+        if not driver:
+            log_activity("assignment_failed", f"No available driver for delivery {delivery_id}")
+            continue
+        assigned.append((delivery, driver))
+
+    # ETA calculations, one driver -> pickup -> dropoff request per delivery
+    waypoints = [[(driver['driver_lat'], driver['driver_lng']), (d[1], d[2]), (d[3], d[4])] for d, driver in assigned]
+    try:
+        with stage("routing"):
+            all_legs = route_legs_many(waypoints)
+    except Exception as e:
+        all_legs = [e] * len(assigned)
+
+    for (delivery, driver), legs in zip(assigned, all_legs):
+        delivery_id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng = delivery
+        if isinstance(legs, Exception):
+            log_activity("route_error", f"{routing_provider.name} request failed for delivery {delivery_id}: {legs}")
+            continue
+        leg_to_pickup, leg_to_dropoff = legs
+        if not (leg_to_pickup and leg_to_dropoff):
+            log_activity("route_error", f"{routing_provider.name} no route for delivery {delivery_id}")
+            continue
+
+        total_eta, total_distance, full_route = summarize_trip(leg_to_pickup, leg_to_dropoff)
+        # eta_to_pickup = float(get_eta_minutes(driver['driver_lat'], driver['driver_lng'], pickup_lat, pickup_lng, model))
+        # eta_delivery = float(get_eta_minutes(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, model))
+        # total_eta = eta_to_pickup + eta_delivery
+
+        # Route
+        # route_to_pickup, _ = suggest_route((driver['driver_lat'], driver['driver_lng']), (pickup_lat, pickup_lng))
+        # route_to_dropoff, _ = suggest_route((pickup_lat, pickup_lng), (dropoff_lat, dropoff_lng))
+        # full_route = [[float(lat), float(lng)] for lat, lng in route_to_pickup + route_to_dropoff[1:]]
+
+
+        with get_connection() as conn:
+            # Update delivery
+            cursor2 = conn.cursor()
+            cursor2.execute("""
+                UPDATE deliveries
+                SET eta_minutes=%s, assigned_driver_id=%s, updated_at=NOW()
+                WHERE delivery_id=%s
+            """, (total_eta, driver['driver_id'], delivery_id))
+
+            #Update route
+            cursor2.execute("""
+                            INSERT INTO routes(delivery_id, waypoints, distance_km, duration_minutes)
+                            VALUES (%s, %s, %s, %s)
+                            """, (delivery_id, full_route, total_distance, total_eta))
+
+            # Set driver unavailable
+            cursor2.execute("UPDATE drivers SET availability=False WHERE driver_id=%s", (driver['driver_id'],))
+        
+            conn.commit()
+            cursor2.close()
+
+        response.append({
+             "delivery_id": delivery_id,
+             "pickup_lat": pickup_lat,
+             "pickup_lng": pickup_lng,
+             "dropoff_lat": dropoff_lat,
+             "dropoff_lng": dropoff_lng,
+             "driver_id": driver['driver_id'],
+             "driver_name": driver['driver_name'],
+             "eta_minutes": total_eta,
+             "route_coordinates": full_route
+        })
+    return response
+
 # MAP
 def plot_map():
     try:
-        conn = get_connection()
-        cur = conn.cursor()
+        with get_connection() as conn:
+            cur = conn.cursor()
         
-        # get drivers
-        cur.execute("SELECT name, current_lat, current_lng, availability FROM drivers")
-        drivers = cur.fetchall()
+            # get drivers
+            cur.execute("SELECT name, current_lat, current_lng, availability FROM drivers")
+            drivers = cur.fetchall()
         
-        # get deliveries
-        cur.execute("""
-            SELECT d.delivery_id, d.pickup_lat, d.pickup_lng, d.dropoff_lat, d.dropoff_lng, 
-                   d.assigned_driver_id, d.status, dr.name
-            FROM deliveries d
-            LEFT JOIN drivers dr ON d.assigned_driver_id = dr.driver_id
-        """)
-        deliveries = cur.fetchall()
+            # get deliveries
+            cur.execute("""
+                SELECT d.delivery_id, d.pickup_lat, d.pickup_lng, d.dropoff_lat, d.dropoff_lng, 
+                       d.assigned_driver_id, d.status, dr.name
+                FROM deliveries d
+                LEFT JOIN drivers dr ON d.assigned_driver_id = dr.driver_id
+            """)
+            deliveries = cur.fetchall()
         
-        # get geofences
-        cur.execute("SELECT name, boundary_coordinates FROM geofences")
-        geofences = cur.fetchall()
+            # get geofences, simplified for drawing
+            cur.execute("""
+                SELECT name, display_wkb, boundary_coordinates FROM geofences
+                WHERE display_wkb IS NOT NULL OR boundary_coordinates IS NOT NULL
+                """)
+            geofences = cur.fetchall()
         
-        cur.close()
-        conn.close()
+            cur.close()
 
         m = folium.Map(location=[14.5547, 121.0244], zoom_start=13)
         
@@ -219,7 +762,7 @@ def plot_map():
         # Geofences
         for gf in geofences:
             try:
-                poly_points = eval(gf[1])
+                poly_points = polygon_coordinates(gf[1], gf[2])
                 folium.Polygon(
                     poly_points, 
                     color='red', 
@@ -235,6 +778,265 @@ def plot_map():
         print(f"Map generation error: {e}")
         return "<p>Error generating map</p>"
 
+# GeoJSON map data for /map/data, so the dashboard draws markers itself
+# instead of reloading a rendered folium page.
+#   ?bbox=min_lng,min_lat,max_lng,max_lat   only features inside the viewport
+#   ?since=<version>                        only what changed since an earlier
+#                                           response's version
+# rows are versioned by migrate_map_versions.py. the version handed back is
+# the oldest transaction still running when the data was read, so anything
+# committed after it shows up in the next delta (some rows may come twice).
+# in a delta, removed lists the ids of deleted features and of changed ones
+# that are now outside the bbox.
+# map_deletions rows older than MAP_DELETIONS_RETENTION seconds are pruned, at
+# most once per MAP_DELETIONS_PRUNE_INTERVAL on each worker. a since at or
+# before the newest pruned version could miss a delete, so it gets a full
+# response instead
+MAP_DELETIONS_RETENTION = int(os.getenv("MAP_DELETIONS_RETENTION", "86400"))
+MAP_DELETIONS_PRUNE_INTERVAL = int(os.getenv("MAP_DELETIONS_PRUNE_INTERVAL", "300"))
+map_deletions_pruned_at = 0.0
+
+def prune_map_deletions():
+    global map_deletions_pruned_at
+    now = time.monotonic()
+    if now - map_deletions_pruned_at < MAP_DELETIONS_PRUNE_INTERVAL:
+        return
+    map_deletions_pruned_at = now
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            WITH pruned AS (
+                DELETE FROM map_deletions WHERE deleted_at < NOW() - make_interval(secs => %s)
+                RETURNING map_version
+            )
+            UPDATE map_deletions_pruned
+            SET map_version = GREATEST(map_version, (SELECT max(map_version) FROM pruned))
+            """, (MAP_DELETIONS_RETENTION,))
+        conn.commit()
+        cursor.close()
+
+def parse_bbox(value):
+    if not value:
+        return None
+    min_lng, min_lat, max_lng, max_lat = (float(v) for v in value.split(','))
+    if min_lng > max_lng or min_lat > max_lat:
+        raise ValueError("bbox must be min_lng,min_lat,max_lng,max_lat")
+    return min_lng, min_lat, max_lng, max_lat
+
+def in_bbox(bbox, lat, lng):
+    return bbox is None or (bbox[1] <= lat <= bbox[3] and bbox[0] <= lng <= bbox[2])
+
+def point_feature(feature_id, lat, lng, properties):
+    return {"type": "Feature", "id": feature_id,
+            "geometry": {"type": "Point", "coordinates": [lng, lat]}, "properties": properties}
+
+def map_data(cursor, bbox=None, since=None):
+    cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+    version = cursor.fetchone()[0]
+    if since is not None:
+        cursor.execute("SELECT map_version FROM map_deletions_pruned")
+        if since <= cursor.fetchone()[0]:
+            since = None
+    features, removed = [], []
+
+    # a full read filters in SQL; a delta reads every changed row, so the
+    # ones that left the viewport can be reported as removed
+    def where(lat_col, lng_col, version_col="map_version"):
+        if since is not None:
+            return f"{version_col} >= %s", [since]
+        if bbox is None:
+            return f"{lat_col} IS NOT NULL", []
+        return (f"{lat_col} BETWEEN %s AND %s AND {lng_col} BETWEEN %s AND %s",
+                [bbox[1], bbox[3], bbox[0], bbox[2]])
+
+    def add(feature_id, lat, lng, properties):
+        if lat is not None and in_bbox(bbox, lat, lng):
+            features.append(point_feature(feature_id, lat, lng, properties))
+        elif since is not None:
+            removed.append(feature_id)
+
+    clause, params = where("current_lat", "current_lng")
+    cursor.execute(f"""
+        SELECT driver_id, name, current_lat, current_lng, current_load, availability
+        FROM drivers WHERE {clause}
+        """, params)
+    for driver_id, name, lat, lng, load, available in cursor.fetchall():
+        add(f"driver:{driver_id}", lat, lng,
+            {"kind": "driver", "driver_id": driver_id, "name": name, "load": load, "available": available})
+
+    clause, params = where("d.pickup_lat", "d.pickup_lng", "d.map_version")
+    if since is None and bbox is not None:
+        dropoff_clause, dropoff_params = where("d.dropoff_lat", "d.dropoff_lng")
+        clause, params = f"(({clause}) OR ({dropoff_clause}))", params + dropoff_params
+    cursor.execute(f"""
+        SELECT d.delivery_id, d.pickup_lat, d.pickup_lng, d.dropoff_lat, d.dropoff_lng, d.status, dr.name
+        FROM deliveries d
+        LEFT JOIN drivers dr ON d.assigned_driver_id = dr.driver_id
+        WHERE {clause}
+        """, params)
+    for delivery_id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, status, driver_name in cursor.fetchall():
+        properties = {"delivery_id": delivery_id, "status": status or "unassigned", "driver_name": driver_name}
+        add(f"pickup:{delivery_id}", pickup_lat, pickup_lng, dict(properties, kind="pickup"))
+        add(f"dropoff:{delivery_id}", dropoff_lat, dropoff_lng, dict(properties, kind="dropoff"))
+
+    if since is not None:
+        clause, params = "map_version >= %s", [since]
+    elif bbox is not None:
+        # unconverted rows have no bbox columns yet and are checked below
+        clause, params = ("(min_lat IS NULL OR (max_lat >= %s AND min_lat <= %s AND max_lng >= %s AND min_lng <= %s))",
+                          [bbox[1], bbox[3], bbox[0], bbox[2]])
+    else:
+        clause, params = "TRUE", []
+    cursor.execute(f"""
+        SELECT geofence_id, name, display_wkb, boundary_coordinates, min_lat, min_lng, max_lat, max_lng
+        FROM geofences WHERE (display_wkb IS NOT NULL OR boundary_coordinates IS NOT NULL) AND {clause}
+        """, params)
+    for geofence_id, name, display_wkb, boundary_text, min_lat, min_lng, max_lat, max_lng in cursor.fetchall():
+        feature_id = f"geofence:{geofence_id}"
+        try:
+            geometry = polygon_geojson(display_wkb, boundary_text)
+            if min_lat is None:
+                min_lng, min_lat, max_lng, max_lat = row_polygon(None, boundary_text).bounds
+        except Exception as e:
+            print(f"Error parsing geofence {name}: {e}")
+            continue
+        if bbox is None or (max_lat >= bbox[1] and min_lat <= bbox[3] and max_lng >= bbox[0] and min_lng <= bbox[2]):
+            features.append({"type": "Feature", "id": feature_id, "geometry": geometry,
+                             "properties": {"kind": "geofence", "geofence_id": geofence_id, "name": name}})
+        else:
+            removed.append(feature_id)
+
+    if since is not None:
+        cursor.execute("SELECT kind, id FROM map_deletions WHERE map_version >= %s", (since,))
+        for kind, row_id in cursor.fetchall():
+            if kind == "delivery":
+                removed.extend([f"pickup:{row_id}", f"dropoff:{row_id}"])
+            else:
+                removed.append(f"{kind}:{row_id}")
+
+    return {"type": "FeatureCollection", "features": features, "removed": removed,
+            "version": version, "full": since is None}
+
+# keyset-paginated listings for /drivers/log and /deliveries/logs
+#   ?limit=100            rows per page, at most LOG_PAGE_MAX
+#   ?cursor=<id>          continue after the next_cursor of the previous page
+#   ?order=asc|desc       direction of the id ordering
+#   ?fields=a,b           only these columns (the id is always included)
+#   ?format=ndjson        stream every row from a server-side cursor instead
+LOG_PAGE_SIZE = int(os.getenv("LOG_PAGE_SIZE", "100"))
+LOG_PAGE_MAX = int(os.getenv("LOG_PAGE_MAX", "1000"))
+LOG_STREAM_ITERSIZE = int(os.getenv("LOG_STREAM_ITERSIZE", "2000"))
+
+DRIVER_COLUMNS = ("driver_id", "name", "current_lat", "current_lng", "current_load", "availability")
+# /deliveries/logs used to return SELECT *, so its columns are whatever the
+# deliveries table has, read once per worker on first use, less the ones
+# kept for the app's own bookkeeping
+INTERNAL_COLUMNS = ("map_version",)
+table_columns_cache = {}
+
+def table_columns(table):
+    if table not in table_columns_cache:
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT * FROM {table} LIMIT 0")
+            table_columns_cache[table] = tuple(column[0] for column in cursor.description
+                                               if column[0] not in INTERNAL_COLUMNS)
+            cursor.close()
+    return table_columns_cache[table]
+
+def json_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+def row_dict(columns, row):
+    return {column: json_value(value) for column, value in zip(columns, row)}
+
+def parse_keyset_args(columns, key, default_order):
+    fields = request.args.get('fields')
+    if fields:
+        selected = [f.strip() for f in fields.split(',') if f.strip()]
+        unknown = [f for f in selected if f not in columns]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        if key not in selected:
+            selected.insert(0, key)
+    else:
+        selected = list(columns)
+
+    order = request.args.get('order', default_order).lower()
+    if order not in ('asc', 'desc'):
+        raise ValueError("order must be asc or desc")
+
+    cursor = request.args.get('cursor')
+    limit = request.args.get('limit')
+    try:
+        cursor = int(cursor) if cursor is not None else None
+        limit = int(limit) if limit is not None else None
+    except ValueError:
+        raise ValueError("cursor and limit must be integers")
+    if limit is not None and limit < 1:
+        raise ValueError("limit must be positive")
+    return selected, order, cursor, limit
+
+# column and table names only ever come from the fixed lists above or the
+# table's own columns
+def keyset_query(table, key, selected, order, cursor, limit):
+    query = f"SELECT {', '.join(selected)} FROM {table}"
+    params = []
+    if cursor is not None:
+        query += f" WHERE {key} {'<' if order == 'desc' else '>'} %s"
+        params.append(cursor)
+    query += f" ORDER BY {key} {order.upper()}"
+    if limit is not None:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
+# rows go out in batches as they are fetched, so memory stays flat however
+# large the table is. the pooled connection is held until the stream ends
+def stream_rows(table, selected, query, params):
+    with get_connection() as conn:
+        cursor = conn.cursor(name=f"{table}_export")
+        cursor.itersize = LOG_STREAM_ITERSIZE
+        cursor.execute(query, params)
+        while True:
+            rows = cursor.fetchmany(LOG_STREAM_ITERSIZE)
+            if not rows:
+                break
+            # same encoder as jsonify, so numeric, date and uuid columns work
+            yield "".join(app.json.dumps(row_dict(selected, row)) + "\n" for row in rows)
+        cursor.close()
+
+def keyset_response(table, key, columns, name, default_order):
+    try:
+        selected, order, cursor, limit = parse_keyset_args(columns, key, default_order)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    stream = request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == 'application/x-ndjson'
+    if stream:
+        query, params = keyset_query(table, key, selected, order, cursor, limit)
+        return Response(stream_with_context(stream_rows(table, selected, query, params)),
+                        mimetype='application/x-ndjson')
+
+    limit = min(limit or LOG_PAGE_SIZE, LOG_PAGE_MAX)
+    # one extra row tells whether there is a next page
+    query, params = keyset_query(table, key, selected, order, cursor, limit + 1)
+    with get_connection() as conn:
+        cur = conn.cursor()
+        cur.execute(query, params)
+        rows = cur.fetchall()
+        cur.close()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return jsonify({
+        name: [row_dict(selected, row) for row in rows],
+        "count": len(rows),
+        "next_cursor": rows[-1][selected.index(key)] if has_more else None
+    }), 200
+
 # API ENDPOINTS
 
 # drivers post and get 
@@ -248,16 +1050,18 @@ def add_driver():
         if current_lat is None or current_lng is None:
             return jsonify({"error": "Invalid address or geocoding failed"}), 400
         
-        conn = get_connection()
-        cursor = conn.cursor()
+        with get_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-                       INSERT INTO drivers(name, current_lat, current_lng, current_load, availability)
-                       VALUES (%s, %s, %s, %s, %s)
-                       """, (name, current_lat, current_lng, 0, True))
-        conn.commit()
-        cursor.close()
-        conn.close()
+            cursor.execute("""
+                           INSERT INTO drivers(name, current_lat, current_lng, current_load, availability)
+                           VALUES (%s, %s, %s, %s, %s)
+                           RETURNING driver_id
+                           """, (name, current_lat, current_lng, 0, True))
+            driver_id = cursor.fetchone()[0]
+            conn.commit()
+            cursor.close()
+        driver_index.upsert(driver_id, name, current_lat, current_lng, 0, True)
         
         log_activity("add_driver", f"Added driver {name} at {data.get('current_address')} ({current_lat}, {current_lng})")  
         return jsonify({"message": "Driver added successfully", "driver": {"name": name, "lat": current_lat, "lng": current_lng}}), 201
@@ -274,52 +1078,76 @@ def update_drivers():
         if current_lat is None or current_lng is None:
             return jsonify({"error": "Invalid address or geocoding failed"}), 400
 
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-                       UPDATE drivers
-                       SET current_lat = %s, current_lng = %s
-                       WHERE driver_id = %s
-                       """, (current_lat, current_lng, driver_id))
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                           UPDATE drivers
+                           SET current_lat = %s, current_lng = %s
+                           WHERE driver_id = %s
+                           """, (current_lat, current_lng, driver_id))
 
-        if cursor.rowcount == 0:
-            conn.rollback()
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "Driver not found"}), 404
+            if cursor.rowcount == 0:
+                conn.rollback()
+                cursor.close()
+                return jsonify({"error": "Driver not found"}), 404
             
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
+        driver_index.update(driver_id, lat=current_lat, lng=current_lng)
         
         log_activity("update_driver", f"Updated driver {driver_id} to {current_lat}, {current_lng}")
         return jsonify({"message": "Driver location updated successfully"}), 200
     except Exception as e:
         return jsonify({"error": f"Failed to update driver: {str(e)}"}), 500
 
+# batched GPS pings: {"pings": [{"driver_id", "lat", "lng", "timestamp"?}, ...]}
+# timestamp is epoch seconds or ISO 8601, defaulting to now. positions are
+# buffered and written to drivers every GPS_FLUSH_SECONDS
+GPS_MAX_PINGS = int(os.getenv("GPS_MAX_PINGS", "10000"))
+
+def parse_ping(item, now):
+    driver_id = int(item['driver_id'])
+    lat, lng = float(item['lat']), float(item['lng'])
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        raise ValueError("lat/lng out of range")
+    ts = item.get('timestamp')
+    if ts is None:
+        ts = now
+    elif isinstance(ts, str):
+        ts = datetime.fromisoformat(ts).timestamp()
+    else:
+        ts = float(ts)
+    return driver_id, lat, lng, ts
+
+@app.route('/drivers/positions', methods=['POST'])
+def ingest_driver_positions():
+    try:
+        data = request.get_json(silent=True) or {}
+        items = data.get('pings') if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            return jsonify({"error": "pings must be a list"}), 400
+        if len(items) > GPS_MAX_PINGS:
+            return jsonify({"error": f"At most {GPS_MAX_PINGS} pings per request"}), 400
+
+        now = datetime.now().timestamp()
+        pings, errors = [], []
+        for i, item in enumerate(items):
+            try:
+                pings.append(parse_ping(item, now))
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                errors.append({"index": i, "error": str(e)})
+
+        for driver_id, lat, lng, _ in position_buffer.ingest(pings):
+            driver_index.update(driver_id, lat=lat, lng=lng)
+
+        return jsonify({"accepted": len(pings), "rejected": len(errors), "errors": errors[:20]}), 202
+    except Exception as e:
+        return jsonify({"error": f"Failed to ingest positions: {str(e)}"}), 500
+
 @app.route('/drivers/log', methods=['GET'])
 def get_drivers():
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT driver_id, name, current_lat, current_lng, current_load, availability FROM drivers")
-        logs = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        
-        # Convert to more readable format
-        drivers_list = []
-        for log in logs:
-            drivers_list.append({
-                "driver_id": log[0],
-                "name": log[1],
-                "current_lat": log[2],
-                "current_lng": log[3],
-                "current_load": log[4],
-                "availability": log[5]
-            })
-        
-        return jsonify({"drivers": drivers_list}), 200
+        return keyset_response("drivers", "driver_id", DRIVER_COLUMNS, "drivers", "asc")
     except Exception as e:
         return jsonify({"error": f"Failed to get drivers: {str(e)}"}), 500
 
@@ -331,28 +1159,28 @@ def add_deliveries_api():
         pickup_address = data.get('pickup_address')
         dropoff_address = data.get('dropoff_address')
         
-        pickup_lat, pickup_lng = get_lat_lng_from_address(pickup_address)
-        dropoff_lat, dropoff_lng = get_lat_lng_from_address(dropoff_address)
+        (pickup_lat, pickup_lng), (dropoff_lat, dropoff_lng) = get_lat_lngs_from_addresses([pickup_address, dropoff_address])
         
         if None in [pickup_lat, pickup_lng, dropoff_lat, dropoff_lng]:
             return jsonify({"error": "Invalid pickup or dropoff address"}), 400
         
-        conn = get_connection()
-        cursor = conn.cursor()
+        with get_connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-                       INSERT INTO deliveries(pickup_address, pickup_lat, pickup_lng, dropoff_address, dropoff_lat, dropoff_lng, status) 
-                       VALUES(%s, %s, %s, %s, %s, %s, %s)
-                       RETURNING delivery_id
-                       """, (pickup_address, pickup_lat, pickup_lng, dropoff_address, dropoff_lat, dropoff_lng, 'pending'))
+            cursor.execute("""
+                           INSERT INTO deliveries(pickup_address, pickup_lat, pickup_lng, dropoff_address, dropoff_lat, dropoff_lng, status) 
+                           VALUES(%s, %s, %s, %s, %s, %s, %s)
+                           RETURNING delivery_id
+                           """, (pickup_address, pickup_lat, pickup_lng, dropoff_address, dropoff_lat, dropoff_lng, 'pending'))
         
-        result = cursor.fetchone()
-        delivery_id = result[0] if result else None
-        conn.commit()
-        cursor.close()
-        conn.close()
+            result = cursor.fetchone()
+            delivery_id = result[0] if result else None
+            conn.commit()
+            cursor.close()
         
         log_activity("add_delivery", f"Added delivery {delivery_id} from {pickup_address} to {dropoff_address}")
+        if ASSIGN_ON_NEW_DELIVERY:
+            assignment_jobs.trigger("new_delivery")
         return jsonify({
             "message": "Delivery request created successfully", 
             "delivery_id": delivery_id,
@@ -372,33 +1200,41 @@ def update_deliveries_api():
         if not delivery_id or not new_status:
             return jsonify({'error': "delivery_id and new_status are requires"}), 400
         
-        conn= get_connection()
-        cursor= conn.cursor()
+        with get_connection() as conn:
+            cursor= conn.cursor()
 
-        cursor.execute("""
-                    SELECT assigned_driver_id FROM deliveries WHERE delivery_id = %s
-                    """, (delivery_id,))
-        result_driver= cursor.fetchone()
+            cursor.execute("""
+                        SELECT assigned_driver_id FROM deliveries WHERE delivery_id = %s
+                        """, (delivery_id,))
+            result_driver= cursor.fetchone()
 
-        if not result_driver:
-            cursor.close()
-            conn.close()
-            return jsonify({"error": "Delivery not found"}), 404
+            if not result_driver:
+                cursor.close()
+                return jsonify({"error": "Delivery not found"}), 404
         
-        assigned_driver_id= result_driver[0]
+            assigned_driver_id= result_driver[0]
 
-        cursor.execute("""
-                       UPDATE deliveries SET status=%s, updated_at=NOW() WHERE delivery_id=%s
-                       """, (new_status, delivery_id))
-        
-        if new_status == 'delivered' and assigned_driver_id:
             cursor.execute("""
-                           UPDATE drivers SET availability= TRUE WHERE driver_id=%s
-                           """, (assigned_driver_id,))
+                           UPDATE deliveries SET status=%s, updated_at=NOW() WHERE delivery_id=%s
+                           """, (new_status, delivery_id))
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            # a driver on a tour stays busy until the last order on board is
+            # delivered. the driver row is locked first, so two dropoffs of one
+            # tour landing together can't each see the other still open
+            freed = False
+            if new_status == 'delivered' and assigned_driver_id:
+                cursor.execute("SELECT driver_id FROM drivers WHERE driver_id=%s FOR UPDATE", (assigned_driver_id,))
+                cursor.execute("""
+                               UPDATE drivers SET availability= TRUE WHERE driver_id=%s
+                               AND NOT EXISTS (SELECT 1 FROM deliveries WHERE assigned_driver_id = %s
+                                               AND status IN ('assigned', 'in_transit'))
+                               """, (assigned_driver_id, assigned_driver_id))
+                freed = cursor.rowcount > 0
+        
+            conn.commit()
+            cursor.close()
+        if freed:
+            driver_index.update(assigned_driver_id, available=True)
 
         log_activity("update_delivery", f"Updated delivery {delivery_id} to status {new_status}")
         return jsonify({"message": f"Delivery {delivery_id} updated to {new_status}"}), 200
@@ -406,107 +1242,173 @@ def update_deliveries_api():
     except Exception as e:
         return jsonify({"error": f"Failed to update delivery: {str(e)}"}), 500
 
-@app.route('/deliveries/assign', methods=['GET'])
-def assign_deliveries_api():
-    try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT delivery_id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng
-            FROM deliveries
-            WHERE assigned_driver_id IS NULL AND status='pending'
-            """)
-    
-        deliveries = cursor.fetchall()
-        response = []
+ASSIGN_MODES = ('greedy', 'bulk', 'optimal', 'tours')
+# pending deliveries bulk, optimal and tours runs claim per transaction
+ASSIGN_CLAIM_BATCH = int(os.getenv("ASSIGN_CLAIM_BATCH", "200"))
+# tours plan each claimed batch as one problem, so they take fewer at a time
+TOUR_CLAIM_BATCH = int(os.getenv("TOUR_CLAIM_BATCH", "50"))
 
-        for delivery in deliveries:
-            delivery_id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng = delivery
 
-            # Check geofences
-            if check_geofence(pickup_lat, pickup_lng) or check_geofence(dropoff_lat, dropoff_lng):
-                log_activity("geofence_violation", f"Delivery {delivery_id} inside geofence, skipped")
-                continue
+# road minutes from each delivery's candidate drivers to its pickup, with one
+# matrix call over all the candidates
+def candidate_travel_minutes(deliveries, candidates):
+    travel_min = {}
+    sources = list({c[0]: c for cs in candidates.values() for c in cs}.values())
+    if deliveries and sources:
+        try:
+            with stage("travel_matrix"):
+                matrix = travel_time_matrix([(d[2], d[3]) for d in sources], [(d[1], d[2]) for d in deliveries])
+            rows = {d[0]: row for row, d in enumerate(sources)}
+            for col, delivery in enumerate(deliveries):
+                travel_min[delivery[0]] = {c[0]: float(matrix[rows[c[0]], col]) for c in candidates[delivery[0]]}
+        except Exception as e:
+            print(f"Travel time matrix error: {e}")
+    return travel_min
 
-            # Assign nearest **available** driver
-            driver = assign_driver_to_order(delivery_id, pickup_lat, pickup_lng)
-            if not driver:
-                log_activity("assignment_failed", f"No available driver for delivery {delivery_id}")
-                continue
+# road minutes for exactly the drivers about to be compared for a delivery.
+# candidates the up-front matrix didn't cover (the index moved on since) are
+# fetched now; if any is still missing, or the up-front matrix failed, None
+# compares them all on straight-line distance instead of mixing the two
+def scored_minutes(delivery, candidates, travel_min):
+    known = travel_min.get(delivery[0])
+    if known is None:
+        return None
+    missing = [c for c in candidates if c[0] not in known]
+    if missing:
+        known.update(candidate_travel_minutes([delivery], {delivery[0]: missing}).get(delivery[0], {}))
+    if all(c[0] in known for c in candidates):
+        return {c[0]: known[c[0]] for c in candidates}
+    return None
 
-            # ETA calculations
-            osmr_url_to_pickup = f"http://router.project-osrm.org/route/v1/driving/{driver['driver_lng']},{driver['driver_lat']};{pickup_lng},{pickup_lat}?overview=full&geometries=geojson"
-            osmr_url_to_dropoff = f"http://router.project-osrm.org/route/v1/driving/{pickup_lng},{pickup_lat};{dropoff_lng},{dropoff_lat}?overview=full&geometries=geojson"
-            try:
-                resp = requests.get(osmr_url_to_pickup, timeout=5).json()
-                resp2 = requests.get(osmr_url_to_dropoff, timeout=5).json()
-                if resp.get("routes") and resp2.get("routes"):
-                    #eta
-                    eta_to_pickup = resp["routes"][0]["duration"] / 60
-                    eta_delivery = resp2["routes"][0]["duration"] / 60
-                    total_eta = eta_to_pickup + eta_delivery
-
-                    #route
-                    route_to_pickup = resp["routes"][0]["geometry"]["coordinates"]
-                    route_to_dropoff = resp2["routes"][0]["geometry"]["coordinates"]
-                    full_route = [f"{lat},{lng}" for lat, lng in route_to_pickup + route_to_dropoff[1:]]
-
-                    #distance
-                    distance_to_pickup = resp["routes"][0]["distance"] / 1000  # Convert to km
-                    distance_delivery = resp2["routes"][0]["distance"] / 1000  # Convert to km
-                    total_distance = distance_to_pickup + distance_delivery
-                else:
-                    log_activity("route_error", f"OSRM no route for delivery {delivery_id}")
-                    continue
-            except Exception as e:
-                log_activity("route_error", f"OSRM request failed for delivery {delivery_id}: {e}")
-                continue
-            # eta_to_pickup = float(get_eta_minutes(driver['driver_lat'], driver['driver_lng'], pickup_lat, pickup_lng, model))
-            # eta_delivery = float(get_eta_minutes(pickup_lat, pickup_lng, dropoff_lat, dropoff_lng, model))
-            # total_eta = eta_to_pickup + eta_delivery
+# adds a batch's summary fields to the run's: numbers are summed, lists
+# concatenated and nested dicts merged the same way
+def merge_summary(total, extra):
+    for key, value in extra.items():
+        if isinstance(value, dict):
+            merge_summary(total.setdefault(key, {}), value)
+        elif isinstance(value, list):
+            total.setdefault(key, []).extend(value)
+        else:
+            total[key] = round(total.get(key, 0) + value, 3)
 
-            # Route
-            # route_to_pickup, _ = suggest_route((driver['driver_lat'], driver['driver_lng']), (pickup_lat, pickup_lng))
-            # route_to_dropoff, _ = suggest_route((pickup_lat, pickup_lng), (dropoff_lat, dropoff_lng))
-            # full_route = [[float(lat), float(lng)] for lat, lng in route_to_pickup + route_to_dropoff[1:]]
+# assigns one batch of claimed deliveries. drivers come from driver_index,
+# which holds no locks; write_assignments locks and re-checks the picked
+# drivers when the results are written
+def assign_claimed_batch(mode, deliveries, chunk_size=ASSIGN_CHUNK_SIZE):
+    extra = {}
+    if mode == 'tours':
+        response, extra = assign_deliveries_tours(deliveries, chunk_size)
+        return response, extra
+    with stage("candidates"):
+        candidates = {d[0]: driver_index.nearest(d[1], d[2], DRIVER_CANDIDATES) for d in deliveries}
+    travel_min = candidate_travel_minutes(deliveries, candidates)
+    if mode == 'optimal':
+        drivers = list({c[0]: c for cs in candidates.values() for c in cs}.values())
+        response, extra["cost"] = assign_deliveries_optimal(deliveries, drivers, travel_min, chunk_size)
+    else:
+        response = assign_deliveries_bulk(deliveries, travel_min, chunk_size)
+    return response, extra
 
+# one assignment run over the pending backlog, shared by the endpoint and
+# the background jobs. returns (pending count, assignments, extra fields).
+# bulk, optimal and tours lease the backlog in batches of claim_batch, so
+# runs on several workers split it instead of colliding; greedy locks each
+# delivery as it assigns it
+def run_assignment(mode='greedy', chunk_size=ASSIGN_CHUNK_SIZE, claim_batch=ASSIGN_CLAIM_BATCH):
+    # every mode takes its candidates from driver_index, resynced once per
+    # run so it starts from what other workers have written
+    with stage("fetch"):
+        driver_index.refresh(force=True)
+    # connections are taken per database step, never across index lookups or
+    # routing, since the indexes check out their own when they reload
+    if mode not in ('bulk', 'optimal', 'tours'):
+        with stage("fetch"):
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT delivery_id, pickup_lat, pickup_lng, dropoff_lat, dropoff_lng
+                    FROM deliveries
+                    WHERE assigned_driver_id IS NULL AND status='pending'
+                    """)
+                deliveries = cursor.fetchall()
+                cursor.close()
+        # road travel time to every pending pickup, only from the drivers
+        # the spatial index puts among its nearest candidates
+        with stage("candidates"):
+            candidates = {d[0]: driver_index.nearest(d[1], d[2], DRIVER_CANDIDATES) for d in deliveries}
+        travel_min = candidate_travel_minutes(deliveries, candidates)
+        return len(deliveries), assign_deliveries_greedy(deliveries, travel_min), {}
 
-            # Update delivery
-            cursor2 = conn.cursor()
-            cursor2.execute("""
-                UPDATE deliveries
-                SET eta_minutes=%s, assigned_driver_id=%s, updated_at=NOW()
-                WHERE delivery_id=%s
-            """, (total_eta, driver['driver_id'], delivery_id))
+    if mode == 'tours':
+        claim_batch = min(claim_batch, TOUR_CLAIM_BATCH)
+    pending, response, extra, after_id = 0, [], {}, 0
+    while True:
+        with stage("claim"):
+            deliveries, last_id = claim_deliveries(after_id, claim_batch)
+        # an empty first batch still runs, so the summary fields are there
+        if last_id == after_id and after_id:
+            break
+        try:
+            batch_response, batch_extra = assign_claimed_batch(mode, deliveries, chunk_size)
+        finally:
+            release_claims([d[0] for d in deliveries])
+        pending += len(deliveries)
+        response.extend(batch_response)
+        merge_summary(extra, batch_extra)
+        if last_id == after_id:
+            break
+        after_id = last_id
+    return pending, response, extra
 
-            #Update route
-            cursor2.execute("""
-                            INSERT INTO routes(delivery_id, waypoints, distance_km, duration_minutes)
-                            VALUES (%s, %s, %s, %s)
-                            """, (delivery_id, full_route, total_distance, total_eta))
 
-            # Set driver unavailable
-            cursor2.execute("UPDATE drivers SET availability=False WHERE driver_id=%s", (driver['driver_id'],))
-            
-            conn.commit()
-            cursor2.close()
+# what a background job keeps as its result: counts and the picks, without
+# the route geometry
+def run_assignment_job(params):
+    mode = params.get('mode', 'bulk')
+    pending, response, extra = run_assignment(mode, int(params.get('chunk_size', ASSIGN_CHUNK_SIZE)))
+    if response:
+        log_activity("assigned_delivery", f"Assignment job ({mode}) assigned {len(response)} deliveries")
+    result = {
+        "pending": pending,
+        "total_assigned": len(response),
+        "unassigned": pending - len(response),
+        "assignments": [{k: v for k, v in item.items() if k != "route_coordinates"} for item in response],
+    }
+    result.update(extra)
+    return result
 
-            response.append({
-                 "delivery_id": delivery_id,
-                 "pickup_lat": pickup_lat,
-                 "pickup_lng": pickup_lng,
-                 "dropoff_lat": dropoff_lat,
-                 "dropoff_lng": dropoff_lng,
-                 "driver_id": driver['driver_id'],
-                 "driver_name": driver['driver_name'],
-                 "eta_minutes": total_eta,
-                 "route_coordinates": full_route
-            })
 
-        cursor.close()
-        conn.close()
+assignment_jobs = JobManager(run_assignment_job)
+atexit.register(assignment_jobs.close)
+if ASSIGN_SCHEDULE_SECONDS > 0:
+    assignment_jobs.start()
+
+
+@app.route('/deliveries/assign', methods=['GET'])
+def assign_deliveries_api():
+    # mode=bulk assigns the whole backlog in one transaction, mode=optimal
+    # does the same with a min-cost matching instead of greedy picks and
+    # mode=tours bundles several deliveries into one tour per driver
+    mode = request.args.get('mode', 'greedy')
+    if mode not in ASSIGN_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(ASSIGN_MODES)}"}), 400
+    try:
+        chunk_size = int(request.args.get('chunk_size', ASSIGN_CHUNK_SIZE))
+    except ValueError:
+        return jsonify({"error": "chunk_size must be an integer"}), 400
+    if chunk_size < 1:
+        return jsonify({"error": "chunk_size must be positive"}), 400
+    # async=true queues the run and answers with the job to poll
+    if request.args.get('async', 'false').lower() == 'true':
+        job = assignment_jobs.submit({"mode": mode, "chunk_size": chunk_size})
+        return jsonify({"job_id": job.id, "status": job.status,
+                        "status_url": f"/deliveries/assign/jobs/{job.id}"}), 202
+    try:
+        _, response, extra = run_assignment(mode, chunk_size)
         if request.headers.get('Accept') == 'application/json' or request.is_json:
-            return jsonify({"assignments": response, "total_assigned": len(response)})
+            result = {"assignments": response, "total_assigned": len(response)}
+            result.update(extra)
+            return jsonify(result)
 
         log_activity("assigned_delivery", f"Assigned deliveries: {response}")
         # Otherwise return HTML
@@ -532,18 +1434,40 @@ def assign_deliveries_api():
     except Exception as e:
         return jsonify({"error": f"Failed to assign deliveries: {str(e)}"}), 500
 
+@app.route('/deliveries/assign/jobs', methods=['POST'])
+def submit_assignment_job():
+    data = request.get_json(silent=True) or {}
+    mode = data.get('mode', 'bulk')
+    if mode not in ASSIGN_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(ASSIGN_MODES)}"}), 400
+    try:
+        chunk_size = int(data.get('chunk_size', ASSIGN_CHUNK_SIZE))
+    except (TypeError, ValueError):
+        return jsonify({"error": "chunk_size must be an integer"}), 400
+    if chunk_size < 1:
+        return jsonify({"error": "chunk_size must be positive"}), 400
+    job = assignment_jobs.submit({"mode": mode, "chunk_size": chunk_size})
+    return jsonify({"job_id": job.id, "status": job.status,
+                    "status_url": f"/deliveries/assign/jobs/{job.id}"}), 202
+
+@app.route('/deliveries/assign/jobs', methods=['GET'])
+def list_assignment_jobs():
+    limit = request.args.get('limit', 20, type=int)
+    return jsonify({"jobs": assignment_jobs.recent(limit)})
+
+@app.route('/deliveries/assign/jobs/<job_id>', methods=['GET'])
+def get_assignment_job(job_id):
+    job = assignment_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
 @app.route('/deliveries/logs', methods=['GET'])
 def get_deliveries_logs():
-    conn = get_connection()
-    cursor= conn.cursor()
-    cursor.execute("""
-                   SELECT * FROM deliveries
-                   ORDER BY delivery_id DESC""")
-    deliveries = cursor.fetchall()
-    cursor.close()
-    conn.close()
-
-    return jsonify({"deliveries": deliveries}), 200
+    try:
+        return keyset_response("deliveries", "delivery_id", table_columns("deliveries"), "deliveries", "desc")
+    except Exception as e:
+        return jsonify({"error": f"Failed to get deliveries: {str(e)}"}), 500
 
 
 # Get specific route suggestion
@@ -554,8 +1478,7 @@ def get_route_suggestion():
         origin_addr = data.get('origin_address')
         dest_addr = data.get('destination_address')
         
-        origin_lat, origin_lng = get_lat_lng_from_address(origin_addr)
-        dest_lat, dest_lng = get_lat_lng_from_address(dest_addr)
+        (origin_lat, origin_lng), (dest_lat, dest_lng) = get_lat_lngs_from_addresses([origin_addr, dest_addr])
         
         if None in [origin_lat, origin_lng, dest_lat, dest_lng]:
             return jsonify({"error": "Invalid origin or destination address"}), 400
@@ -576,27 +1499,54 @@ def get_route_suggestion():
     except Exception as e:
         return jsonify({"error": f"Route calculation failed: {str(e)}"}), 500
 
+# Route cache counters
+@app.route('/route/cache', methods=['GET'])
+def route_cache_stats():
+    return jsonify(route_cache.stats()), 200
+
 # Map endpoint
 @app.route('/map', methods=['GET'])
 def map_api():
     return plot_map()
 
+@app.route('/map/data', methods=['GET'])
+def map_data_api():
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+        since = request.args.get('since')
+        since = int(since) if since not in (None, '') else None
+    except ValueError:
+        return jsonify({"error": "bbox must be min_lng,min_lat,max_lng,max_lat and since an integer version"}), 400
+    try:
+        prune_map_deletions()
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            data = map_data(cursor, bbox, since)
+            cursor.close()
+        return jsonify(data)
+    except Exception as e:
+        return jsonify({"error": f"Failed to get map data: {str(e)}"}), 500
+
 # Geofence management endpoints
 @app.route('/geofences', methods=['GET'])
 def get_geofences():
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT geofence_id, name, boundary_coordinates, created_at FROM geofences ORDER BY created_at DESC")
-        geofences = cursor.fetchall()
-        cursor.close()
-        conn.close()
+        # ?simplified=true returns the display geometry instead of the full boundary
+        column = "display_wkb" if request.args.get('simplified', 'false').lower() == 'true' else "boundary_wkb"
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(f"""
+                SELECT geofence_id, name, {column}, created_at, boundary_coordinates
+                FROM geofences ORDER BY created_at DESC
+                """)
+            geofences = cursor.fetchall()
+            cursor.close()
         
         geofences_list = []
         for gf in geofences:
             try:
-                coordinates = eval(gf[2]) if gf[2] else []
-            except:
+                coordinates = polygon_coordinates(gf[2], gf[4])
+            except Exception:
                 coordinates = []
                 
             geofences_list.append({
@@ -635,22 +1585,26 @@ def add_geofence():
         # Ensure polygon is closed (first point = last point)
         if coordinates[0] != coordinates[-1]:
             coordinates.append(coordinates[0])
+
+        polygon = geofence_polygon(coordinates)
+        if not polygon.is_valid:
+            return jsonify({"error": "Coordinates must form a valid, non self-intersecting polygon"}), 400
             
-        conn = get_connection()
-        cursor = conn.cursor()
+        with get_connection() as conn:
+            cursor = conn.cursor()
         
-        cursor.execute("""
-            INSERT INTO geofences (name, boundary_coordinates)
-            VALUES (%s, %s)
-            RETURNING geofence_id
-        """, (name, str(coordinates)))
+            cursor.execute("""
+                INSERT INTO geofences (name, boundary_wkb, min_lat, min_lng, max_lat, max_lng, display_wkb)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                RETURNING geofence_id
+            """, (name,) + geofence_columns(polygon))
         
-        result = cursor.fetchone()
-        geofence_id = result[0] if result else None
+            result = cursor.fetchone()
+            geofence_id = result[0] if result else None
         
-        conn.commit()
-        cursor.close()
-        conn.close()
+            conn.commit()
+            cursor.close()
+        geofence_index.invalidate()
         
         log_activity("add_geofence", f"Added geofence '{name}' with {len(coordinates)} points")
         
@@ -667,22 +1621,22 @@ def add_geofence():
 @app.route('/geofences/<int:geofence_id>', methods=['DELETE'])
 def delete_geofence(geofence_id):
     try:
-        conn = get_connection()
-        cursor = conn.cursor()
+        with get_connection() as conn:
+            cursor = conn.cursor()
         
-        # Get geofence name before deleting
-        cursor.execute("SELECT name FROM geofences WHERE geofence_id = %s", (geofence_id,))
-        result = cursor.fetchone()
+            # Get geofence name before deleting
+            cursor.execute("SELECT name FROM geofences WHERE geofence_id = %s", (geofence_id,))
+            result = cursor.fetchone()
         
-        if not result:
-            return jsonify({"error": "Geofence not found"}), 404
+            if not result:
+                return jsonify({"error": "Geofence not found"}), 404
             
-        geofence_name = result[0]
+            geofence_name = result[0]
         
-        cursor.execute("DELETE FROM geofences WHERE geofence_id = %s", (geofence_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
+            cursor.execute("DELETE FROM geofences WHERE geofence_id = %s", (geofence_id,))
+            conn.commit()
+            cursor.close()
+        geofence_index.invalidate()
         
         log_activity("delete_geofence", f"Deleted geofence '{geofence_name}' (ID: {geofence_id})")
         
@@ -711,17 +1665,106 @@ def check_geofence_api():
     except Exception as e:
         return jsonify({"error": f"Geofence check failed: {str(e)}"}), 500
 
+# Batch geocoding
+# {"addresses": [...]} -> one {"address", "lat", "lng"} per address, in order
+GEOCODE_BATCH_MAX = int(os.getenv("GEOCODE_BATCH_MAX", "1000"))
+
+@app.route('/geocode/batch', methods=['POST'])
+def geocode_batch_api():
+    try:
+        data = request.get_json(silent=True) or {}
+        addresses = data.get('addresses')
+        if not isinstance(addresses, list) or not all(isinstance(a, str) for a in addresses):
+            return jsonify({"error": "addresses must be a list of strings"}), 400
+        if len(addresses) > GEOCODE_BATCH_MAX:
+            return jsonify({"error": f"At most {GEOCODE_BATCH_MAX} addresses per request"}), 400
+
+        results = get_lat_lngs_from_addresses(addresses)
+        return jsonify({
+            "results": [{"address": a, "lat": lat, "lng": lng} for a, (lat, lng) in zip(addresses, results)],
+            "resolved": sum(lat is not None for lat, _ in results),
+            "total": len(addresses)
+        })
+    except Exception as e:
+        return jsonify({"error": f"Batch geocoding failed: {str(e)}"}), 500
+
+# Bulk geofence check
+# body is either JSON {"points": [[lat, lng], ...]} (or {"lats": [...], "lngs": [...]})
+# answered in one response, or NDJSON with one [lat, lng] / {"lat", "lng"} per line,
+# answered as NDJSON in chunks of GEOFENCE_BULK_CHUNK points
+GEOFENCE_BULK_CHUNK = int(os.getenv("GEOFENCE_BULK_CHUNK", "10000"))
+
+def parse_point(item):
+    if isinstance(item, dict):
+        return float(item['lat']), float(item['lng'])
+    return float(item[0]), float(item[1])
+
+def check_geofence_ndjson(lines):
+    def flush(points):
+        lats, lngs = zip(*points)
+        names = geofence_index.lookup_many(lats, lngs)
+        return "".join(json.dumps({"lat": lat, "lng": lng, "geofence_name": name}) + "\n"
+                       for lat, lng, name in zip(lats, lngs, names))
+
+    points = []
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            points.append(parse_point(json.loads(line)))
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            if points:
+                yield flush(points)
+                points = []
+            yield json.dumps({"line": line_no, "error": f"Invalid point: {e}"}) + "\n"
+            continue
+        if len(points) >= GEOFENCE_BULK_CHUNK:
+            yield flush(points)
+            points = []
+    if points:
+        yield flush(points)
+
+@app.route('/geofence/check/bulk', methods=['POST'])
+def check_geofence_bulk_api():
+    try:
+        if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+            lines = (line.decode('utf-8') for line in request.stream)
+            return Response(stream_with_context(check_geofence_ndjson(lines)), mimetype='application/x-ndjson')
+
+        data = request.get_json(silent=True) or {}
+        try:
+            if 'points' in data:
+                points = [parse_point(p) for p in data['points']]
+                lats = [p[0] for p in points]
+                lngs = [p[1] for p in points]
+            else:
+                lats = np.asarray(data['lats'], dtype=np.float64)
+                lngs = np.asarray(data['lngs'], dtype=np.float64)
+                if lats.shape != lngs.shape or lats.ndim != 1:
+                    raise ValueError("lats and lngs must be flat arrays of the same length")
+        except (ValueError, KeyError, IndexError, TypeError) as e:
+            return jsonify({"error": f"Invalid points: {e}"}), 400
+
+        names = geofence_index.lookup_many(lats, lngs)
+        return jsonify({
+            "count": len(names),
+            "inside_count": int(sum(name is not None for name in names)),
+            "geofence_names": names.tolist()
+        })
+    except Exception as e:
+        return jsonify({"error": f"Bulk geofence check failed: {str(e)}"}), 500
+
 # Activity logs
 @app.route('/activity_logs', methods=['GET'])
 def get_logs_api():
     try:
         limit = request.args.get('limit', 50, type=int)
-        conn = get_connection()
-        cur = conn.cursor()
-        cur.execute("SELECT timestamp, activity_type, details FROM activity_logs ORDER BY timestamp DESC LIMIT %s", (limit,))
-        logs = cur.fetchall()
-        cur.close()
-        conn.close()
+        with get_connection() as conn:
+            cur = conn.cursor()
+            cur.execute("SELECT timestamp, activity_type, details FROM activity_logs ORDER BY timestamp DESC LIMIT %s", (limit,))
+            logs = cur.fetchall()
+            cur.close()
         
         logs_list = []
         for log in logs:
@@ -739,9 +1782,13 @@ def get_logs_api():
 @app.route('/health', methods=['GET'])
 def health_check():
     try:
-        conn = get_connection()
-        conn.close()
-        return jsonify({"status": "healthy", "database": "connected"}), 200
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+        return jsonify({"status": "healthy", "database": "connected", "pool": db_pool.stats(),
+                        "activity_log": activity_log.stats(), "geofences": geofence_index.stats(),
+                        "geocoder": geocoder.stats(), "drivers": driver_index.stats(), "gps": position_buffer.stats()}), 200
     except Exception as e:
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
 
@@ -0,0 +1,174 @@
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from db import get_connection
+
+# seconds between scheduled assignment runs, 0 turns the scheduler off
+ASSIGN_SCHEDULE_SECONDS = float(os.getenv("ASSIGN_SCHEDULE_SECONDS", "0"))
+# ASSIGN_ON_NEW_DELIVERY=1 also queues a run whenever a delivery is requested
+ASSIGN_ON_NEW_DELIVERY = os.getenv("ASSIGN_ON_NEW_DELIVERY", "0") == "1"
+ASSIGN_SCHEDULE_MODE = os.getenv("ASSIGN_SCHEDULE_MODE", "bulk")
+# finished jobs kept for the status endpoint
+ASSIGN_JOB_HISTORY = int(os.getenv("ASSIGN_JOB_HISTORY", "100"))
+# ASSIGN_JOB_LOCK=1 runs jobs one at a time across worker processes too, e.g.
+# so every worker's scheduler doesn't fire at once. runs don't need it to
+# stay correct, deliveries and drivers are claimed row by row
+ASSIGN_JOB_LOCK = os.getenv("ASSIGN_JOB_LOCK", "0") == "1"
+# postgres advisory lock key used by ASSIGN_JOB_LOCK
+ASSIGN_LOCK_KEY = 727001
+
+_current = threading.local()
+
+
+class Job:
+    def __init__(self, params, trigger):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.trigger = trigger
+        self.status = "queued"
+        self.stage = None
+        self.stages = {}  # stage name -> seconds
+        self.result = None
+        self.error = None
+        self.submitted_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "trigger": self.trigger,
+            "params": self.params,
+            "stage": self.stage,
+            "stage_seconds": {name: round(seconds, 4) for name, seconds in self.stages.items()},
+            "result": self.result,
+            "error": self.error,
+            "submitted_at": self.submitted_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+# times a named stage of the job running on this thread; a no-op outside
+# a job, so the assignment code can be called from a request as well
+@contextmanager
+def stage(name):
+    job = getattr(_current, "job", None)
+    if job is None:
+        yield
+        return
+    previous, job.stage = job.stage, name
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        job.stages[name] = job.stages.get(name, 0.0) + time.monotonic() - started
+        job.stage = previous
+
+
+# runs assignment jobs one at a time on a background thread. runner(params)
+# does the work and returns a JSON-able result. a scheduler thread can queue
+# runs periodically, and trigger() queues one unless a run is already waiting
+class JobManager:
+    def __init__(self, runner, history=ASSIGN_JOB_HISTORY, schedule_seconds=ASSIGN_SCHEDULE_SECONDS,
+                 schedule_params=None, use_lock=ASSIGN_JOB_LOCK):
+        self.runner = runner
+        self.use_lock = use_lock
+        self.history = history
+        self.schedule_seconds = schedule_seconds
+        self.schedule_params = schedule_params or {"mode": ASSIGN_SCHEDULE_MODE}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self._stop = threading.Event()
+
+    def start(self):
+        # executor and scheduler are per process, restarted after a fork
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="assign-job")
+                    self._stop.clear()
+                    if self.schedule_seconds > 0:
+                        threading.Thread(target=self._schedule, name="assign-scheduler", daemon=True).start()
+                    self._pid = os.getpid()
+
+    def submit(self, params, trigger="api"):
+        self.start()
+        job = Job(params, trigger)
+        with self._lock:
+            self._jobs[job.id] = job
+            finished = [j for j in self._jobs.values() if j.status not in ("queued", "running")]
+            for old in finished[:max(0, len(self._jobs) - self.history)]:
+                del self._jobs[old.id]
+        self._executor.submit(self._run, job)
+        return job
+
+    # queues a run with the schedule params unless one is already waiting
+    def trigger(self, reason="new_delivery"):
+        with self._lock:
+            waiting = next((j for j in self._jobs.values() if j.status == "queued"), None)
+        return waiting or self.submit(dict(self.schedule_params), trigger=reason)
+
+    def _schedule(self):
+        while not self._stop.wait(self.schedule_seconds):
+            try:
+                self.trigger("schedule")
+            except Exception as e:
+                print(f"Assignment scheduler error: {e}")
+
+    def _run(self, job):
+        job.status = "running"
+        job.started_at = datetime.now()
+        _current.job = job
+        try:
+            if not self.use_lock:
+                job.result = self.runner(job.params)
+                job.status = "done"
+                return
+            # the lock connection stays checked out for the whole run
+            with get_connection() as lock_conn:
+                cursor = lock_conn.cursor()
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", (ASSIGN_LOCK_KEY,))
+                if not cursor.fetchone()[0]:
+                    job.status = "skipped"
+                    job.error = "Another assignment run holds the lock"
+                    cursor.close()
+                    return
+                try:
+                    job.result = self.runner(job.params)
+                    job.status = "done"
+                finally:
+                    cursor.execute("SELECT pg_advisory_unlock(%s)", (ASSIGN_LOCK_KEY,))
+                    lock_conn.commit()
+                    cursor.close()
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+            print(f"Assignment job {job.id} failed: {e}")
+        finally:
+            _current.job = None
+            job.stage = None
+            job.finished_at = datetime.now()
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def recent(self, limit=20):
+        with self._lock:
+            jobs = list(self._jobs.values())[-limit:]
+        return [job.to_dict() for job in reversed(jobs)]
+
+    def close(self):
+        self._stop.set()
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown(wait=True)
@@ -0,0 +1,148 @@
+import sys
+import numpy as np
+
+# cost given to pairs that must not be matched (no route); picks at or
+# above it are dropped
+UNREACHABLE_COST = 1e9
+# bid limit for the auction fallback, a safety net against slow convergence
+AUCTION_MAX_BIDS = 10_000_000
+
+
+# min-cost assignment of rows (deliveries) to columns (drivers), each used
+# at most once. returns (rows, cols) index arrays of the matched pairs.
+# scipy's Hungarian solver when available, otherwise an auction
+def solve_assignment(cost):
+    cost = np.where(np.isfinite(cost), cost, UNREACHABLE_COST)
+    if cost.size == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    try:
+        from scipy.optimize import linear_sum_assignment
+        rows, cols = linear_sum_assignment(cost)
+    except ImportError:
+        bounded = bounded_costs(cost)
+        if cost.shape[0] <= cost.shape[1]:
+            rows, cols = auction_assignment(bounded)
+        else:
+            cols, rows = auction_assignment(bounded.T)
+    keep = cost[rows, cols] < UNREACHABLE_COST
+    return rows[keep], cols[keep]
+
+
+# unreachable pairs priced just above any assignment of reachable ones, so
+# the auction still prefers matching more rows but its prices stay at the
+# scale of the real costs (at 1e9 the final eps is below float spacing and
+# bids stop moving)
+def bounded_costs(cost):
+    reachable = cost < UNREACHABLE_COST
+    if not reachable.any():
+        return np.zeros_like(cost, dtype=np.float64)
+    low, high = float(cost[reachable].min()), float(cost[reachable].max())
+    penalty = high + (high - low) * min(cost.shape) + 1.0
+    return np.where(reachable, cost, penalty)
+
+
+# forward auction with epsilon scaling for n <= m. rows bid for their best
+# column, raising its price by the bid margin; the result is within m * eps
+# of the optimum, with eps shrunk until that is below min_eps (but never under
+# what the price scale can represent). extra columns are matched to
+# zero-benefit dummy rows so the problem is square. after max_bids bids the
+# auction stops and rows still bidding take the best free column
+def auction_assignment(cost, min_eps=1e-6, max_bids=AUCTION_MAX_BIDS):
+    n, m = cost.shape
+    benefit = np.zeros((m, m))
+    benefit[:n] = -np.asarray(cost, dtype=np.float64)
+    real_rows = n
+    n = m
+    prices = np.zeros(m)
+    span = float(np.ptp(benefit)) or 1.0
+    eps = span / 4
+    final_eps = max(min_eps / max(n, 1), span * 1e-12)
+    bids = 0
+    while True:
+        owner = np.full(m, -1)
+        assigned = np.full(n, -1)
+        unassigned = list(range(n))
+        while unassigned:
+            if bids >= max_bids:
+                print(f"Auction stopped after {bids} bids, {len(unassigned)} rows matched greedily")
+                free = owner < 0
+                for i in unassigned:
+                    j = int(np.argmax(np.where(free, benefit[i] - prices, -np.inf)))
+                    free[j] = False
+                    assigned[i] = j
+                return np.arange(real_rows), assigned[:real_rows]
+            bids += 1
+            i = unassigned.pop()
+            values = benefit[i] - prices
+            if m == 1:
+                j, second = 0, values[0] - span
+            else:
+                top2 = np.argpartition(-values, 1)[:2]
+                j, other = (top2[0], top2[1]) if values[top2[0]] >= values[top2[1]] else (top2[1], top2[0])
+                second = values[other]
+            prices[j] += values[j] - second + eps
+            if owner[j] >= 0:
+                assigned[owner[j]] = -1
+                unassigned.append(owner[j])
+            owner[j] = i
+            assigned[i] = j
+        if eps <= final_eps:
+            break
+        eps = max(eps / 5, final_eps)
+    return np.arange(real_rows), assigned[:real_rows]
+
+
+# the greedy baseline: rows in order, each taking the cheapest free column
+def greedy_assignment(cost):
+    cost = np.where(np.isfinite(cost), cost, UNREACHABLE_COST)
+    taken = np.zeros(cost.shape[1], dtype=bool)
+    rows, cols = [], []
+    for i in range(cost.shape[0]):
+        if taken.all():
+            break
+        j = int(np.argmin(np.where(taken, np.inf, cost[i])))
+        if cost[i, j] >= UNREACHABLE_COST:
+            continue
+        taken[j] = True
+        rows.append(i)
+        cols.append(j)
+    return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64)
+
+
+# compares the auction's total cost with scipy's on random matrices that
+# contain unreachable pairs
+def verify_auction(samples=20, seed=0):
+    from scipy.optimize import linear_sum_assignment
+    rng = np.random.default_rng(seed)
+    mismatches = []
+    for sample in range(samples):
+        n, m = int(rng.integers(1, 60)), int(rng.integers(1, 60))
+        cost = rng.random((n, m)) * 30
+        cost[rng.random((n, m)) < 0.2] = np.inf
+        cost = np.where(np.isfinite(cost), cost, UNREACHABLE_COST)
+        rows, cols = linear_sum_assignment(cost)
+        expected = cost[rows, cols]
+        bounded = bounded_costs(cost)
+        if n <= m:
+            rows, cols = auction_assignment(bounded)
+        else:
+            cols, rows = auction_assignment(bounded.T)
+        got = cost[rows, cols]
+        # same number of reachable pairs, and the same total over them
+        matched, expected_matched = got < UNREACHABLE_COST, expected < UNREACHABLE_COST
+        if matched.sum() != expected_matched.sum() or abs(got[matched].sum() - expected[expected_matched].sum()) > 1e-4:
+            mismatches.append((sample, n, m, float(expected[expected_matched].sum()), float(got[matched].sum())))
+    return mismatches
+
+
+# python assignment_solver.py check [samples]
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "check":
+        print("usage: python assignment_solver.py check [samples]")
+        sys.exit(1)
+    samples = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    mismatches = verify_auction(samples)
+    print(f"auction: {samples} matrices checked, {len(mismatches)} mismatches")
+    for sample, n, m, expected, got in mismatches[:10]:
+        print(f"  #{sample} {n}x{m}: scipy {expected:.4f}, auction {got:.4f}")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,128 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+import psycopg2
+from psycopg2 import pool, extensions
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))  # seconds to wait for a free connection
+DB_POOL_CHECK_IDLE = float(os.getenv("DB_POOL_CHECK_IDLE", "30"))  # ping connections idle longer than this
+
+
+# process-wide pool of postgres connections. created lazily and per pid, so
+# forked workers never share a socket with their parent
+class ConnectionPool:
+    def __init__(self, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX, timeout=DB_POOL_TIMEOUT):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self._pool = None
+        self._pid = None
+        self._slots = None
+        self._last_used = {}
+        self._lock = threading.Lock()
+
+    def _get_pool(self):
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    self._pool = pool.ThreadedConnectionPool(
+                        self.minconn, self.maxconn,
+                        host=os.getenv("DB_HOST"),
+                        port=os.getenv("DB_PORT"),
+                        database=os.getenv("DB_NAME"),
+                        user=os.getenv("DB_USER"),
+                        password=os.getenv("DB_PASSWORD")
+                    )
+                    # ThreadedConnectionPool errors out when exhausted, the
+                    # semaphore makes callers wait for a free connection instead
+                    self._slots = threading.BoundedSemaphore(self.maxconn)
+                    self._last_used = {}
+                    self._pid = os.getpid()
+        return self._pool
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        if time.monotonic() - self._last_used.get(id(conn), 0) < DB_POOL_CHECK_IDLE:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self):
+        db_pool = self._get_pool()
+        if not self._slots.acquire(timeout=self.timeout):
+            raise pool.PoolError(f"No database connection available after {self.timeout}s")
+        try:
+            # drop dead connections until a healthy one turns up
+            for _ in range(self.maxconn + 1):
+                conn = db_pool.getconn()
+                if self._healthy(conn):
+                    return conn
+                self._last_used.pop(id(conn), None)
+                db_pool.putconn(conn, close=True)
+            raise pool.PoolError("Could not get a healthy database connection")
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, conn, broken=False):
+        try:
+            if not conn.closed and not broken:
+                status = conn.info.transaction_status
+                if status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            close = broken or bool(conn.closed)
+            if close:
+                self._last_used.pop(id(conn), None)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+            self._pool.putconn(conn, close=close)
+        except psycopg2.Error:
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        if self._pool is None:
+            return {"min": self.minconn, "max": self.maxconn, "open": 0, "in_use": 0}
+        return {
+            "min": self.minconn,
+            "max": self.maxconn,
+            "open": len(self._pool._pool) + len(self._pool._used),
+            "in_use": len(self._pool._used),
+        }
+
+    def closeall(self):
+        if self._pool is not None and self._pid == os.getpid():
+            self._pool.closeall()
+        self._pool = None
+
+
+db_pool = ConnectionPool()
+
+
+# with get_connection() as conn: ... checks a connection out of the pool and
+# always returns it; uncommitted work is rolled back on the way back
+@contextmanager
+def get_connection():
+    conn = db_pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        db_pool.putconn(conn, broken=broken)
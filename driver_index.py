@@ -0,0 +1,172 @@
+import os
+import math
+import time
+import heapq
+import threading
+from util import haversine
+from db import get_connection
+
+# grid cell size in degrees (~1.1 km at Manila's latitude)
+DRIVER_GRID_CELL_DEG = float(os.getenv("DRIVER_GRID_CELL_DEG", "0.01"))
+# how many drivers the assignment scores per delivery
+DRIVER_CANDIDATES = int(os.getenv("DRIVER_CANDIDATES", "8"))
+# full resync from the drivers table, picks up changes made by other workers
+DRIVER_INDEX_REFRESH_SECONDS = float(os.getenv("DRIVER_INDEX_REFRESH_SECONDS", "30"))
+# km a unit of current load is worth when ranking drivers
+LOAD_WEIGHT = 2
+
+KM_PER_DEG = 6371 * math.pi / 180
+
+
+# uniform grid of available drivers. positions, load and availability are
+# updated in place as drivers move or get assigned, and nearest() walks
+# rings of cells outward from the pickup until no unvisited cell can hold a
+# better driver. drivers are (driver_id, name, lat, lng, load) rows, the
+# same shape the assignment code reads from the drivers table
+class DriverIndex:
+    def __init__(self, rows=None, cell_deg=DRIVER_GRID_CELL_DEG, refresh_seconds=DRIVER_INDEX_REFRESH_SECONDS):
+        self.cell_deg = cell_deg
+        self.refresh_seconds = refresh_seconds
+        self._drivers = {}    # driver_id -> [driver_id, name, lat, lng, load, available]
+        self._cells = {}      # (row, col) -> set of available driver ids
+        self._bounds = None   # [min row, max row, min col, max col] of cells ever linked
+        self._lock = threading.RLock()
+        self._loaded_at = None
+        if rows is not None:
+            self.reset(rows)
+            # built from a snapshot, never resynced from the database
+            self._loaded_at = math.inf
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.cell_deg), math.floor(lng / self.cell_deg))
+
+    def _unlink(self, driver):
+        if driver[5]:
+            cell = self._cell(driver[2], driver[3])
+            ids = self._cells.get(cell)
+            if ids is not None:
+                ids.discard(driver[0])
+                if not ids:
+                    del self._cells[cell]
+
+    def _link(self, driver):
+        if driver[5]:
+            row, col = cell = self._cell(driver[2], driver[3])
+            self._cells.setdefault(cell, set()).add(driver[0])
+            if self._bounds is None:
+                self._bounds = [row, row, col, col]
+            else:
+                b = self._bounds
+                b[0], b[1], b[2], b[3] = min(b[0], row), max(b[1], row), min(b[2], col), max(b[3], col)
+
+    # rows of available drivers, or (..., availability) rows for all drivers
+    def reset(self, rows):
+        with self._lock:
+            self._drivers.clear()
+            self._cells.clear()
+            self._bounds = None
+            for row in rows:
+                available = row[5] if len(row) > 5 else True
+                self._upsert(row[0], row[1], row[2], row[3], row[4] or 0, bool(available))
+
+    def _upsert(self, driver_id, name, lat, lng, load, available):
+        if lat is None or lng is None:
+            return
+        driver = [driver_id, name, float(lat), float(lng), load, available]
+        self._drivers[driver_id] = driver
+        self._link(driver)
+
+    def upsert(self, driver_id, name, lat, lng, load=0, available=True):
+        with self._lock:
+            self.remove(driver_id)
+            self._upsert(driver_id, name, lat, lng, load, available)
+
+    # partial update, e.g. update(7, lat=.., lng=..) or update(7, available=False)
+    def update(self, driver_id, lat=None, lng=None, load=None, load_delta=0, available=None):
+        with self._lock:
+            driver = self._drivers.get(driver_id)
+            if driver is None:
+                return False
+            self._unlink(driver)
+            if lat is not None and lng is not None:
+                driver[2], driver[3] = float(lat), float(lng)
+            if load is not None:
+                driver[4] = load
+            driver[4] += load_delta
+            if available is not None:
+                driver[5] = bool(available)
+            self._link(driver)
+            return True
+
+    def remove(self, driver_id):
+        with self._lock:
+            driver = self._drivers.pop(driver_id, None)
+            if driver is not None:
+                self._unlink(driver)
+
+    # up to k available drivers with the lowest straight-line km plus
+    # LOAD_WEIGHT * load, best first. exclude is a set of driver ids to skip
+    def nearest(self, lat, lng, k=DRIVER_CANDIDATES, exclude=None):
+        self.refresh()
+        with self._lock:
+            if not self._cells:
+                return []
+            row0, col0 = self._cell(lat, lng)
+            min_row, max_row, min_col, max_col = self._bounds
+            max_ring = max(abs(row0 - min_row), abs(row0 - max_row), abs(col0 - min_col), abs(col0 - max_col))
+            # any driver outside ring r is at least this many km per ring away
+            ring_km = 0.99 * self.cell_deg * KM_PER_DEG * math.cos(math.radians(min(abs(lat) + self.cell_deg, 89.0)))
+            best = []  # max-heap of (-score, driver_id)
+            for ring in range(max_ring + 1):
+                for cell in self._ring(row0, col0, ring):
+                    for driver_id in self._cells.get(cell, ()):
+                        if exclude and driver_id in exclude:
+                            continue
+                        d = self._drivers[driver_id]
+                        score = haversine(lat, lng, d[2], d[3]) + LOAD_WEIGHT * d[4]
+                        if len(best) < k:
+                            heapq.heappush(best, (-score, driver_id))
+                        elif score < -best[0][0]:
+                            heapq.heapreplace(best, (-score, driver_id))
+                # cells beyond this ring are at least ring * ring_km away
+                if len(best) >= k and -best[0][0] <= ring * ring_km:
+                    break
+            return [tuple(self._drivers[driver_id][:5]) for _, driver_id in sorted(best, reverse=True)]
+
+    @staticmethod
+    def _ring(row0, col0, ring):
+        if ring == 0:
+            yield (row0, col0)
+            return
+        for col in range(col0 - ring, col0 + ring + 1):
+            yield (row0 - ring, col)
+            yield (row0 + ring, col)
+        for row in range(row0 - ring + 1, row0 + ring):
+            yield (row, col0 - ring)
+            yield (row, col0 + ring)
+
+    def refresh(self, force=False):
+        if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+            return
+        with self._lock:
+            if not force and self._loaded_at is not None and time.monotonic() - self._loaded_at < self.refresh_seconds:
+                return
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT driver_id, name, current_lat, current_lng, current_load, availability FROM drivers")
+                rows = cursor.fetchall()
+                cursor.close()
+            self.reset(rows)
+            self._loaded_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "drivers": len(self._drivers),
+                "available": sum(len(ids) for ids in self._cells.values()),
+                "cells": len(self._cells),
+                "cell_deg": self.cell_deg,
+            }
+
+
+driver_index = DriverIndex()
@@ -0,0 +1,69 @@
+import sys
+import numpy as np
+import joblib
+from eta_infer import FEATURES, COMPILED_LR_PATH, COMPILED_RF_PATH, load_compiled_model
+
+# turns the pickled sklearn ETA models into the numpy-only format read by
+# eta_infer.py and checks the two agree:
+#   python eta_export.py
+
+
+def _check_features(model):
+    names = tuple(getattr(model, 'feature_names_in_', FEATURES))
+    if names != FEATURES:
+        raise ValueError(f"Model features {names} don't match {FEATURES}")
+
+
+def export_linear(model, path):
+    _check_features(model)
+    np.savez(path, kind='linear', coef=np.asarray(model.coef_, dtype=np.float64),
+             intercept=np.float64(model.intercept_))
+
+
+def export_forest(model, path):
+    _check_features(model)
+    roots, left, right, feature, threshold, value = [], [], [], [], [], []
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        roots.append(offset)
+        left.append(np.where(tree.children_left == -1, -1, tree.children_left + offset))
+        right.append(np.where(tree.children_right == -1, -1, tree.children_right + offset))
+        feature.append(tree.feature)
+        threshold.append(tree.threshold)
+        value.append(tree.value[:, 0, 0])
+        offset += tree.node_count
+    np.savez(path, kind='forest', roots=np.array(roots, dtype=np.int64),
+             left=np.concatenate(left).astype(np.int64), right=np.concatenate(right).astype(np.int64),
+             feature=np.concatenate(feature).astype(np.int64), threshold=np.concatenate(threshold),
+             value=np.concatenate(value))
+
+
+# max absolute difference between the sklearn and compiled predictions on
+# random features over the ranges the API sees
+def check_parity(model, compiled, samples=10000, seed=0):
+    import pandas as pd
+    rng = np.random.default_rng(seed)
+    X = np.column_stack([
+        rng.uniform(0, 50, samples),
+        rng.integers(0, 24, samples),
+        rng.integers(0, 7, samples),
+    ]).astype(np.float64)
+    expected = model.predict(pd.DataFrame(X, columns=list(FEATURES)))
+    return float(np.max(np.abs(expected - compiled.predict(X))))
+
+
+if __name__ == "__main__":
+    exports = (
+        ('model/delivery_eta_lr.pkl', COMPILED_LR_PATH, export_linear),
+        ('model/delivery_eta_rf.pkl', COMPILED_RF_PATH, export_forest),
+    )
+    failed = False
+    for pickle_path, compiled_path, export in exports:
+        model = joblib.load(pickle_path)
+        export(model, compiled_path)
+        diff = check_parity(model, load_compiled_model(compiled_path))
+        ok = diff <= 1e-9
+        failed = failed or not ok
+        print(f"{pickle_path} -> {compiled_path}: max abs diff {diff:.3g} {'ok' if ok else 'MISMATCH'}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,71 @@
+import os
+import numpy as np
+
+# numpy-only evaluation of the ETA models exported by eta_export.py, so the
+# API doesn't need scikit-learn or pandas at runtime. features are the
+# columns of an (n, 3) array in FEATURES order
+FEATURES = ('distance_km', 'hour', 'weekday')
+COMPILED_LR_PATH = 'model/delivery_eta_lr.npz'
+COMPILED_RF_PATH = 'model/delivery_eta_rf.npz'
+
+
+class CompiledETAModel:
+    feature_names_in_ = np.array(FEATURES)
+
+    def _features(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        return X.reshape(1, -1) if X.ndim == 1 else X
+
+
+class LinearETAModel(CompiledETAModel):
+    def __init__(self, coef, intercept):
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = float(intercept)
+
+    def predict(self, X):
+        return self._features(X) @ self.coef + self.intercept
+
+
+# every tree's nodes live in one set of flat arrays; children are global
+# node indices (-1 at leaves) and roots[t] is where tree t starts
+class ForestETAModel(CompiledETAModel):
+    def __init__(self, roots, left, right, feature, threshold, value):
+        self.roots = np.asarray(roots, dtype=np.int64)
+        self.left = np.asarray(left, dtype=np.int64)
+        self.right = np.asarray(right, dtype=np.int64)
+        self.feature = np.asarray(feature, dtype=np.int64)
+        self.threshold = np.asarray(threshold, dtype=np.float64)
+        self.value = np.asarray(value, dtype=np.float64)
+
+    def predict(self, X):
+        # sklearn compares float32 features against its thresholds
+        X = self._features(X).astype(np.float32).astype(np.float64)
+        rows = np.arange(len(X))[:, None]
+        node = np.broadcast_to(self.roots, (len(X), len(self.roots))).copy()
+        # walk all samples down all trees one level per iteration
+        while True:
+            inner = self.left[node] != -1
+            if not inner.any():
+                break
+            go_left = X[rows, np.where(inner, self.feature[node], 0)] <= self.threshold[node]
+            node = np.where(inner, np.where(go_left, self.left[node], self.right[node]), node)
+        return self.value[node].mean(axis=1)
+
+
+def load_compiled_model(path):
+    with np.load(path) as data:
+        kind = str(data['kind'])
+        if kind == 'linear':
+            return LinearETAModel(data['coef'], data['intercept'])
+        if kind == 'forest':
+            return ForestETAModel(data['roots'], data['left'], data['right'],
+                                  data['feature'], data['threshold'], data['value'])
+    raise ValueError(f"Unknown compiled model kind '{kind}' in {path}")
+
+
+# compiled artifact when it exists, otherwise the pickled sklearn model
+def load_eta_model(compiled_path=COMPILED_LR_PATH, pickle_path='model/delivery_eta_lr.pkl'):
+    if os.path.exists(compiled_path):
+        return load_compiled_model(compiled_path)
+    import joblib
+    return joblib.load(pickle_path)
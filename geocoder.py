@@ -0,0 +1,214 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from road_graph import DEFAULT_BBOX
+
+GEOCODER = os.getenv("GEOCODER", "opencage").lower()  # "opencage" or "fake"
+GEOCODE_CACHE_SIZE = int(os.getenv("GEOCODE_CACHE_SIZE", "50000"))
+# sqlite file behind the in-memory LRU, empty to keep the cache in memory only
+GEOCODE_CACHE_PATH = os.getenv("GEOCODE_CACHE_PATH", "cache/geocode.sqlite")
+GEOCODE_TTL_SECONDS = float(os.getenv("GEOCODE_TTL_SECONDS", str(30 * 24 * 3600)))
+# addresses the geocoder could not resolve are remembered for less time
+GEOCODE_NEGATIVE_TTL_SECONDS = float(os.getenv("GEOCODE_NEGATIVE_TTL_SECONDS", str(24 * 3600)))
+GEOCODE_CONCURRENCY = int(os.getenv("GEOCODE_CONCURRENCY", "4"))
+
+
+# cache key for an address: case, spacing and comma spacing don't matter
+def normalize_address(address):
+    address = re.sub(r"\s+", " ", str(address or "")).strip().casefold()
+    return re.sub(r"\s*,\s*", ", ", address).strip(" ,")
+
+
+class OpenCageGeocoder:
+    def __init__(self, api_key=None):
+        from geopy.geocoders import OpenCage
+        self.geolocator = OpenCage(api_key=api_key or os.getenv("GEO_API_KEY"))
+
+    # (lat, lng), or None when the address has no match. errors are raised
+    # so a timeout is not cached as "not found"
+    def geocode(self, address):
+        location = self.geolocator.geocode(address)
+        if location:
+            return location.latitude, location.longitude
+        return None
+
+
+# deterministic stand-in for tests and local runs: every address maps to a
+# fixed point inside the default graph bbox, addresses starting with
+# "invalid" have no match
+class FakeGeocoder:
+    def __init__(self, bbox=DEFAULT_BBOX):
+        self.north, self.south, self.east, self.west = bbox
+        self.calls = 0
+
+    def geocode(self, address):
+        self.calls += 1
+        key = normalize_address(address)
+        if not key or key.startswith("invalid"):
+            return None
+        digest = hashlib.sha1(key.encode("utf-8")).digest()
+        fy = int.from_bytes(digest[:4], "big") / 2 ** 32
+        fx = int.from_bytes(digest[4:8], "big") / 2 ** 32
+        return (round(self.south + fy * (self.north - self.south), 6),
+                round(self.west + fx * (self.east - self.west), 6))
+
+
+# LRU of normalized address -> (lat, lng, expires_at) in front of a sqlite
+# table. misses are cached too, with lat/lng None and a shorter TTL
+class GeocodeCache:
+    def __init__(self, backend, maxsize=GEOCODE_CACHE_SIZE, path=GEOCODE_CACHE_PATH,
+                 ttl=GEOCODE_TTL_SECONDS, negative_ttl=GEOCODE_NEGATIVE_TTL_SECONDS,
+                 concurrency=GEOCODE_CONCURRENCY):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.concurrency = concurrency
+        self.hits = 0
+        self.misses = 0
+        self.lookups = 0
+        self.errors = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_pid = None
+
+    def _get_db(self):
+        if not self.path:
+            return None
+        if self._db is None or self._db_pid != os.getpid():
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS geocode_cache(
+                    address TEXT PRIMARY KEY, lat REAL, lng REAL, expires_at REAL)
+            """)
+            self._db.commit()
+            self._db_pid = os.getpid()
+        return self._db
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    # cached entries for the given keys, from memory first, then sqlite
+    def _cached(self, keys):
+        now = time.time()
+        found, missing = {}, []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[2] > now:
+                    self._entries.move_to_end(key)
+                    found[key] = entry
+                else:
+                    missing.append(key)
+            db = self._get_db()
+            if db is not None and missing:
+                for i in range(0, len(missing), 500):
+                    chunk = missing[i:i + 500]
+                    rows = db.execute(
+                        f"SELECT address, lat, lng, expires_at FROM geocode_cache "
+                        f"WHERE address IN ({','.join('?' * len(chunk))}) AND expires_at > ?",
+                        chunk + [now]).fetchall()
+                    for address, lat, lng, expires_at in rows:
+                        found[address] = (lat, lng, expires_at)
+                        self._remember(address, found[address])
+        return found
+
+    def _store(self, entries):
+        with self._lock:
+            for key, entry in entries.items():
+                self._remember(key, entry)
+            db = self._get_db()
+            if db is not None and entries:
+                db.executemany("INSERT OR REPLACE INTO geocode_cache(address, lat, lng, expires_at) VALUES (?, ?, ?, ?)",
+                               [(key,) + entry for key, entry in entries.items()])
+                db.commit()
+
+    def _lookup(self, address):
+        try:
+            return self.backend.geocode(address)
+        except Exception as e:
+            print(f"Geocoding error: {e}")
+            return e
+
+    # (lat, lng) per address, (None, None) when it can't be resolved. each
+    # distinct uncached address is sent to the geocoder once, concurrently
+    def geocode_many(self, addresses):
+        keys = [normalize_address(a) for a in addresses]
+        found = self._cached(set(k for k in keys if k))
+
+        # first spelling seen for every normalized address that needs a lookup
+        pending = {}
+        for address, key in zip(addresses, keys):
+            if key and key not in found and key not in pending:
+                pending[key] = address
+        with self._lock:
+            self.hits += sum(1 for k in keys if k in found)
+            self.misses += len(pending)
+
+        if pending:
+            if len(pending) == 1 or self.concurrency <= 1:
+                results = [self._lookup(a) for a in pending.values()]
+            else:
+                with ThreadPoolExecutor(max_workers=min(self.concurrency, len(pending))) as executor:
+                    results = list(executor.map(self._lookup, pending.values()))
+            now = time.time()
+            new_entries = {}
+            for key, result in zip(pending, results):
+                if isinstance(result, Exception):
+                    # transient failure, not cached
+                    continue
+                if result is None:
+                    new_entries[key] = (None, None, now + self.negative_ttl)
+                else:
+                    new_entries[key] = (result[0], result[1], now + self.ttl)
+            with self._lock:
+                self.lookups += len(pending)
+                self.errors += len(pending) - len(new_entries)
+            self._store(new_entries)
+            found.update(new_entries)
+
+        return [(found[k][0], found[k][1]) if k in found else (None, None) for k in keys]
+
+    def geocode(self, address):
+        return self.geocode_many([address])[0]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            db = self._get_db()
+            if db is not None:
+                db.execute("DELETE FROM geocode_cache")
+                db.commit()
+
+    def stats(self):
+        with self._lock:
+            requests_seen = self.hits + self.misses
+            return {
+                "backend": type(self.backend).__name__,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "lookups": self.lookups,
+                "errors": self.errors,
+                "hit_rate": round(self.hits / requests_seen, 3) if requests_seen else None,
+            }
+
+
+def load_geocoder(backend=GEOCODER):
+    if backend == "fake":
+        return GeocodeCache(FakeGeocoder())
+    if backend == "opencage":
+        return GeocodeCache(OpenCageGeocoder())
+    raise ValueError(f"Unknown geocoder {backend!r}, expected 'opencage' or 'fake'")
@@ -0,0 +1,145 @@
+import os
+import ast
+import time
+import threading
+import numpy as np
+import shapely
+from shapely import STRtree
+from shapely.geometry import Point, Polygon
+from shapely.prepared import prep
+from db import get_connection
+
+# how often a worker checks the geofences table for changes made elsewhere
+GEOFENCE_REFRESH_SECONDS = float(os.getenv("GEOFENCE_REFRESH_SECONDS", "5"))
+# simplification tolerance in degrees for the copy drawn on maps (~11 m)
+GEOFENCE_DISPLAY_TOLERANCE = float(os.getenv("GEOFENCE_DISPLAY_TOLERANCE", "0.0001"))
+
+
+# geofence rows keep the polygon as WKB in boundary_wkb (x=lng, y=lat), its
+# bounding box in min_lat/min_lng/max_lat/max_lng and a simplified copy for
+# drawing in display_wkb. the API speaks [lat, lng] pairs
+def geofence_polygon(coordinates):
+    return Polygon([(point[1], point[0]) for point in coordinates])
+
+
+def geofence_columns(polygon):
+    min_lng, min_lat, max_lng, max_lat = polygon.bounds
+    display = polygon.simplify(GEOFENCE_DISPLAY_TOLERANCE, preserve_topology=True)
+    return shapely.to_wkb(polygon), min_lat, min_lng, max_lat, max_lng, shapely.to_wkb(display)
+
+
+# a row's polygon from its WKB, or from the boundary_coordinates text of rows
+# migrate_geofences.py hasn't converted yet
+def row_polygon(wkb, text=None):
+    if wkb is not None:
+        return shapely.from_wkb(bytes(wkb))
+    if text is not None:
+        return geofence_polygon(ast.literal_eval(text))
+    raise ValueError("no boundary")
+
+
+def polygon_coordinates(wkb, text=None):
+    polygon = row_polygon(wkb, text)
+    return [[lat, lng] for lng, lat in polygon.exterior.coords]
+
+
+# GeoJSON geometry, which is [lng, lat] like the stored WKB
+def polygon_geojson(wkb, text=None):
+    return shapely.geometry.mapping(row_polygon(wkb, text))
+
+
+# in-memory geofences: prepared polygons in an STRtree, so a point lookup is
+# a bounding-box query plus a prepared contains. the table is reloaded only
+# when its fingerprint (row counts and id sums) changes, or right away after
+# invalidate() when this worker added or deleted a geofence
+class GeofenceIndex:
+    def __init__(self, refresh_seconds=GEOFENCE_REFRESH_SECONDS):
+        self.refresh_seconds = refresh_seconds
+        self.version = 0
+        self._fingerprint = None
+        self._checked_at = 0.0
+        self._stale = True
+        self._state = ([], [], None)  # names, prepared polygons, tree
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._stale = True
+
+    def _load(self):
+        with get_connection() as conn:
+            cursor = conn.cursor()
+            # count(boundary_wkb) moves when migrate_geofences.py converts a row
+            cursor.execute("""
+                SELECT count(*), count(boundary_wkb), coalesce(max(geofence_id), 0), coalesce(sum(geofence_id), 0)
+                FROM geofences
+                """)
+            fingerprint = cursor.fetchone()
+            if fingerprint == self._fingerprint and not self._stale:
+                cursor.close()
+                return
+            cursor.execute("""
+                SELECT geofence_id, name, boundary_wkb, boundary_coordinates FROM geofences ORDER BY geofence_id
+                """)
+            rows = cursor.fetchall()
+            cursor.close()
+
+        names, polygons = [], []
+        for geofence_id, name, boundary_wkb, boundary_text in rows:
+            try:
+                # rows migrate_geofences.py has not converted yet still count
+                polygons.append(row_polygon(boundary_wkb, boundary_text))
+                names.append(name)
+            except Exception as e:
+                print(f"Error parsing geofence {name}: {e}")
+
+        tree = STRtree(polygons) if polygons else None
+        self._state = (names, [prep(p) for p in polygons], tree)
+        self._fingerprint = fingerprint
+        self.version += 1
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not (force or self._stale or now - self._checked_at >= self.refresh_seconds):
+            return
+        with self._lock:
+            if force or self._stale or now - self._checked_at >= self.refresh_seconds:
+                self._load()
+                self._stale = False
+                self._checked_at = time.monotonic()
+
+    # name of the first geofence containing the point, or None
+    def lookup(self, lat, lng):
+        self.refresh()
+        names, prepared, tree = self._state
+        if tree is None:
+            return None
+        point = Point(lng, lat)
+        for i in sorted(tree.query(point)):
+            if prepared[i].contains(point):
+                return names[i]
+        return None
+
+    # vectorized lookup: one STRtree query for all points, returning an
+    # object array with the first containing geofence name (or None) per point
+    def lookup_many(self, lats, lngs):
+        self.refresh()
+        names, prepared, tree = self._state
+        lats = np.asarray(lats, dtype=np.float64)
+        lngs = np.asarray(lngs, dtype=np.float64)
+        result = np.full(len(lats), None, dtype=object)
+        if tree is None or len(lats) == 0:
+            return result
+        # "within" is the same test as polygon.contains(point) in lookup()
+        point_idx, geofence_idx = tree.query(shapely.points(lngs, lats), predicate="within")
+        if len(point_idx):
+            order = np.lexsort((geofence_idx, point_idx))
+            point_idx, geofence_idx = point_idx[order], geofence_idx[order]
+            first = np.unique(point_idx, return_index=True)[1]
+            result[point_idx[first]] = np.array(names, dtype=object)[geofence_idx[first]]
+        return result
+
+    def stats(self):
+        return {"version": self.version, "geofences": len(self._state[0])}
+
+
+geofence_index = GeofenceIndex()
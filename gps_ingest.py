@@ -0,0 +1,142 @@
+import os
+import atexit
+import threading
+from collections import deque
+from datetime import datetime
+from psycopg2.extras import execute_values
+from db import get_connection
+
+GPS_FLUSH_SECONDS = float(os.getenv("GPS_FLUSH_SECONDS", "2.0"))
+GPS_BATCH_SIZE = int(os.getenv("GPS_BATCH_SIZE", "1000"))
+# GPS_TRACKS=1 also appends every ping to driver_tracks, which
+# migrate_driver_tracks.py creates
+GPS_TRACKS = os.getenv("GPS_TRACKS", "0") == "1"
+# raw pings waiting for the next flush; the oldest are dropped beyond this
+GPS_TRACK_QUEUE_SIZE = int(os.getenv("GPS_TRACK_QUEUE_SIZE", "100000"))
+
+
+# buffers GPS pings in memory. only the newest position per driver is kept
+# and a background thread writes all of them to drivers with one UPDATE
+# every flush interval; with tracks on, the raw pings go to driver_tracks
+class PositionBuffer:
+    def __init__(self, flush_seconds=GPS_FLUSH_SECONDS, batch_size=GPS_BATCH_SIZE,
+                 tracks=GPS_TRACKS, track_queue_size=GPS_TRACK_QUEUE_SIZE):
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.tracks = tracks
+        self._latest = {}  # driver_id -> (lat, lng, epoch seconds), kept to reject late pings
+        self._dirty = set()  # drivers whose newest position isn't written yet
+        self._track_pings = deque(maxlen=track_queue_size)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pid = None
+        self.received = 0
+        self.stale = 0
+        self.positions_written = 0
+        self.tracks_written = 0
+        self.tracks_dropped = 0
+        self.flushes = 0
+        self.failed = 0
+
+    def _ensure_started(self):
+        # one flusher thread per process, restarted after a fork
+        if self._thread is None or self._pid != os.getpid():
+            with self._lock:
+                if self._thread is None or self._pid != os.getpid():
+                    self._stop.clear()
+                    self._thread = threading.Thread(target=self._run, name="gps-flusher", daemon=True)
+                    self._thread.start()
+                    self._pid = os.getpid()
+
+    # pings are (driver_id, lat, lng, epoch seconds). returns the pings that
+    # became a driver's newest position, older ones only feed the track
+    def ingest(self, pings):
+        self._ensure_started()
+        newest = {}
+        with self._lock:
+            for ping in pings:
+                driver_id, lat, lng, ts = ping
+                current = self._latest.get(driver_id)
+                if current is None or ts >= current[2]:
+                    self._latest[driver_id] = (lat, lng, ts)
+                    self._dirty.add(driver_id)
+                    newest[driver_id] = ping
+                else:
+                    self.stale += 1
+                if self.tracks:
+                    if len(self._track_pings) == self._track_pings.maxlen:
+                        self.tracks_dropped += 1
+                    self._track_pings.append(ping)
+            self.received += len(pings)
+        return list(newest.values())
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            latest = {driver_id: self._latest[driver_id] for driver_id in self._dirty}
+            self._dirty = set()
+            track_pings = list(self._track_pings)
+            self._track_pings.clear()
+        if not latest and not track_pings:
+            return
+        try:
+            with get_connection() as conn:
+                cursor = conn.cursor()
+                if latest:
+                    # rows go out in driver_id order, so two workers flushing
+                    # the same drivers lock them in the same order
+                    execute_values(cursor, """
+                        UPDATE drivers
+                        SET current_lat = v.lat, current_lng = v.lng
+                        FROM (VALUES %s) AS v(driver_id, lat, lng)
+                        WHERE drivers.driver_id = v.driver_id
+                        """, [(driver_id, lat, lng) for driver_id, (lat, lng, _) in sorted(latest.items())],
+                        page_size=self.batch_size)
+                if track_pings:
+                    execute_values(cursor, """
+                        INSERT INTO driver_tracks(driver_id, lat, lng, recorded_at)
+                        VALUES %s
+                        """, [(driver_id, lat, lng, datetime.fromtimestamp(ts)) for driver_id, lat, lng, ts in track_pings],
+                        page_size=self.batch_size)
+                conn.commit()
+                cursor.close()
+            self.positions_written += len(latest)
+            self.tracks_written += len(track_pings)
+            self.flushes += 1
+        except Exception as e:
+            # positions are retried on the next flush, raw pings are lost
+            with self._lock:
+                self._dirty.update(latest)
+            self.failed += len(track_pings)
+            print(f"GPS flush error: {e}")
+
+    def close(self, timeout=10):
+        if self._thread is None or self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "drivers_seen": len(self._latest),
+                "pending_positions": len(self._dirty),
+                "pending_tracks": len(self._track_pings),
+                "received": self.received,
+                "stale": self.stale,
+                "positions_written": self.positions_written,
+                "tracks": self.tracks,
+                "tracks_written": self.tracks_written,
+                "tracks_dropped": self.tracks_dropped,
+                "flushes": self.flushes,
+                "failed": self.failed,
+            }
+
+
+position_buffer = PositionBuffer()
+atexit.register(position_buffer.close)
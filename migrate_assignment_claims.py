@@ -0,0 +1,25 @@
+from db import get_connection
+
+# adds the lease table bulk, optimal and tours runs claim pending deliveries
+# in, so runs on several workers split the backlog. safe to run more than once:
+#   python migrate_assignment_claims.py
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assignment_claims(
+    delivery_id integer PRIMARY KEY,
+    claimed_until timestamp NOT NULL
+);
+"""
+
+
+def migrate():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SCHEMA)
+        conn.commit()
+        cursor.close()
+
+
+if __name__ == "__main__":
+    migrate()
+    print("Assignment claims table is installed")
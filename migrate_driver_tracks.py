@@ -0,0 +1,29 @@
+from db import get_connection
+
+# adds driver_tracks, where GPS_TRACKS=1 appends every raw ping. float4
+# keeps ~1 m precision at these coordinates in half the space. safe to run
+# more than once:
+#   python migrate_driver_tracks.py
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS driver_tracks(
+    driver_id integer NOT NULL,
+    lat real NOT NULL,
+    lng real NOT NULL,
+    recorded_at timestamp NOT NULL
+);
+CREATE INDEX IF NOT EXISTS driver_tracks_driver_time_idx ON driver_tracks (driver_id, recorded_at);
+"""
+
+
+def migrate():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SCHEMA)
+        conn.commit()
+        cursor.close()
+
+
+if __name__ == "__main__":
+    migrate()
+    print("Driver tracks table is installed")
@@ -0,0 +1,57 @@
+import ast
+from psycopg2.extras import execute_values
+from db import get_connection
+from geofence_index import geofence_polygon, geofence_columns
+
+# moves geofences from the str(coordinates) text column to WKB with bounding
+# box and display columns. safe to run more than once, only rows without
+# boundary_wkb are converted:
+#   python migrate_geofences.py
+
+SCHEMA = """
+ALTER TABLE geofences
+    ADD COLUMN IF NOT EXISTS boundary_wkb bytea,
+    ADD COLUMN IF NOT EXISTS display_wkb bytea,
+    ADD COLUMN IF NOT EXISTS min_lat double precision,
+    ADD COLUMN IF NOT EXISTS min_lng double precision,
+    ADD COLUMN IF NOT EXISTS max_lat double precision,
+    ADD COLUMN IF NOT EXISTS max_lng double precision;
+ALTER TABLE geofences ALTER COLUMN boundary_coordinates DROP NOT NULL;
+CREATE INDEX IF NOT EXISTS geofences_bbox_idx ON geofences (min_lat, max_lat, min_lng, max_lng);
+"""
+
+
+def migrate():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SCHEMA)
+        cursor.execute("""
+            SELECT geofence_id, name, boundary_coordinates FROM geofences
+            WHERE boundary_wkb IS NULL AND boundary_coordinates IS NOT NULL
+        """)
+        rows = cursor.fetchall()
+
+        converted, failed = [], 0
+        for geofence_id, name, boundary_text in rows:
+            try:
+                polygon = geofence_polygon(ast.literal_eval(boundary_text))
+                converted.append((geofence_id,) + geofence_columns(polygon))
+            except Exception as e:
+                failed += 1
+                print(f"Error converting geofence {geofence_id} ({name}): {e}")
+
+        execute_values(cursor, """
+            UPDATE geofences AS g
+            SET boundary_wkb = v.boundary_wkb, min_lat = v.min_lat, min_lng = v.min_lng,
+                max_lat = v.max_lat, max_lng = v.max_lng, display_wkb = v.display_wkb
+            FROM (VALUES %s) AS v(geofence_id, boundary_wkb, min_lat, min_lng, max_lat, max_lng, display_wkb)
+            WHERE g.geofence_id = v.geofence_id
+        """, converted, template="(%s, %s::bytea, %s, %s, %s, %s, %s::bytea)")
+        conn.commit()
+        cursor.close()
+    return len(converted), failed
+
+
+if __name__ == "__main__":
+    converted, failed = migrate()
+    print(f"Converted {converted} geofences, {failed} failed")
@@ -0,0 +1,94 @@
+from db import get_connection
+
+# adds the change tracking behind /map/data. every insert or update of a
+# driver, delivery or geofence stamps map_version with the id of the writing
+# transaction, and deletes leave a row in map_deletions, so the map can ask
+# for what changed since its last poll whichever worker made the change.
+# map_deletions is pruned by the app after MAP_DELETIONS_RETENTION seconds;
+# map_deletions_pruned keeps the newest version pruned so far. safe to run more than once:
+#   python migrate_map_versions.py
+
+SCHEMA = """
+ALTER TABLE drivers ADD COLUMN IF NOT EXISTS map_version bigint;
+ALTER TABLE deliveries ADD COLUMN IF NOT EXISTS map_version bigint;
+ALTER TABLE geofences ADD COLUMN IF NOT EXISTS map_version bigint;
+
+CREATE TABLE IF NOT EXISTS map_deletions(
+    kind text NOT NULL,
+    id integer NOT NULL,
+    map_version bigint NOT NULL
+);
+ALTER TABLE map_deletions ADD COLUMN IF NOT EXISTS deleted_at timestamp NOT NULL DEFAULT NOW();
+
+CREATE TABLE IF NOT EXISTS map_deletions_pruned(
+    only_row boolean PRIMARY KEY DEFAULT TRUE CHECK (only_row),
+    map_version bigint NOT NULL
+);
+INSERT INTO map_deletions_pruned(map_version) VALUES (0) ON CONFLICT DO NOTHING;
+
+CREATE OR REPLACE FUNCTION set_map_version() RETURNS trigger AS $$
+BEGIN
+    NEW.map_version := txid_current();
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+-- TG_ARGV is (kind, primary key column)
+CREATE OR REPLACE FUNCTION record_map_deletion() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO map_deletions(kind, id, map_version)
+    VALUES (TG_ARGV[0], (to_jsonb(OLD) ->> TG_ARGV[1])::integer, txid_current());
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS drivers_map_version ON drivers;
+CREATE TRIGGER drivers_map_version BEFORE INSERT OR UPDATE ON drivers
+    FOR EACH ROW EXECUTE FUNCTION set_map_version();
+DROP TRIGGER IF EXISTS deliveries_map_version ON deliveries;
+CREATE TRIGGER deliveries_map_version BEFORE INSERT OR UPDATE ON deliveries
+    FOR EACH ROW EXECUTE FUNCTION set_map_version();
+DROP TRIGGER IF EXISTS geofences_map_version ON geofences;
+CREATE TRIGGER geofences_map_version BEFORE INSERT OR UPDATE ON geofences
+    FOR EACH ROW EXECUTE FUNCTION set_map_version();
+
+DROP TRIGGER IF EXISTS drivers_map_deletion ON drivers;
+CREATE TRIGGER drivers_map_deletion AFTER DELETE ON drivers
+    FOR EACH ROW EXECUTE FUNCTION record_map_deletion('driver', 'driver_id');
+DROP TRIGGER IF EXISTS deliveries_map_deletion ON deliveries;
+CREATE TRIGGER deliveries_map_deletion AFTER DELETE ON deliveries
+    FOR EACH ROW EXECUTE FUNCTION record_map_deletion('delivery', 'delivery_id');
+DROP TRIGGER IF EXISTS geofences_map_deletion ON geofences;
+CREATE TRIGGER geofences_map_deletion AFTER DELETE ON geofences
+    FOR EACH ROW EXECUTE FUNCTION record_map_deletion('geofence', 'geofence_id');
+
+CREATE INDEX IF NOT EXISTS drivers_map_version_idx ON drivers (map_version);
+CREATE INDEX IF NOT EXISTS deliveries_map_version_idx ON deliveries (map_version);
+CREATE INDEX IF NOT EXISTS geofences_map_version_idx ON geofences (map_version);
+CREATE INDEX IF NOT EXISTS map_deletions_version_idx ON map_deletions (map_version);
+CREATE INDEX IF NOT EXISTS map_deletions_deleted_at_idx ON map_deletions (deleted_at);
+CREATE INDEX IF NOT EXISTS drivers_position_idx ON drivers (current_lat, current_lng);
+CREATE INDEX IF NOT EXISTS deliveries_pickup_idx ON deliveries (pickup_lat, pickup_lng);
+CREATE INDEX IF NOT EXISTS deliveries_dropoff_idx ON deliveries (dropoff_lat, dropoff_lng);
+"""
+
+# rows written before the migration get its transaction's version
+BACKFILL = """
+UPDATE drivers SET map_version = txid_current() WHERE map_version IS NULL;
+UPDATE deliveries SET map_version = txid_current() WHERE map_version IS NULL;
+UPDATE geofences SET map_version = txid_current() WHERE map_version IS NULL;
+"""
+
+
+def migrate():
+    with get_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(SCHEMA)
+        cursor.execute(BACKFILL)
+        conn.commit()
+        cursor.close()
+
+
+if __name__ == "__main__":
+    migrate()
+    print("Map change tracking is installed")
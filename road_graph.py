@@ -0,0 +1,416 @@
+import os
+import sys
+import json
+import mmap
+import heapq
+import hashlib
+import datetime
+import numpy as np
+
+# binary snapshot of the drive network so app workers don't rebuild the
+# osmnx graph on every restart. layout:
+#   magic | u32 format | u32 header length | json header | aligned arrays
+# arrays are read back with a read-only mmap, so every worker on the host
+# shares the same page-cache pages instead of holding its own copy.
+SNAPSHOT_MAGIC = b"TWGRAPH\0"
+SNAPSHOT_FORMAT = 1
+SNAPSHOT_PATH = os.getenv("GRAPH_SNAPSHOT", "cache/makati_drive.rgraph")
+_ALIGN = 64
+
+# (name, on-disk dtype)
+_ARRAYS = (
+    ("node_ids", "<i8"),   # OSM node id of each node index
+    ("node_lat", "<f8"),
+    ("node_lng", "<f8"),
+    ("indptr", "<i8"),     # CSR row offsets, len = num_nodes + 1
+    ("indices", "<i4"),    # CSR edge targets (node index)
+    ("lengths", "<f8"),    # edge length in meters
+)
+
+# GRAPH_PLACE can widen the routing area (e.g. "Metro Manila, Philippines")
+DEFAULT_PLACE = os.getenv("GRAPH_PLACE", "Makati, Metro Manila, Philippines")
+DEFAULT_BBOX = (14.569, 14.535, 121.043, 121.008)  # north, south, east, west
+
+# "csr" routes on RoadGraph arrays, "networkx" keeps the osmnx MultiDiGraph
+GRAPH_BACKEND = os.getenv("GRAPH_BACKEND", "csr")
+
+
+def download_city_graph(place=DEFAULT_PLACE, bbox=DEFAULT_BBOX):
+    import osmnx as ox
+    try:
+        return ox.graph_from_place(place, network_type="drive")
+    except Exception as e:
+        print("Fallback to bbox due to error:", e)
+        north, south, east, west = bbox
+        return ox.graph_from_bbox(north, south, east, west, network_type="drive")
+
+
+def dijkstra_all(indptr, indices, lengths, sources):
+    # full single-source distances for each source, shape (len(sources), n)
+    n = len(indptr) - 1
+    try:
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.csgraph import dijkstra
+        # explicit zeros in a sparse matrix still count as edges
+        csgraph = csr_matrix((lengths, indices, indptr), shape=(n, n))
+        return np.atleast_2d(dijkstra(csgraph, directed=True, indices=list(sources)))
+    except ImportError:
+        pass
+
+    indptr, indices, lengths = indptr.tolist(), indices.tolist(), lengths.tolist()
+    out = np.full((len(sources), n), np.inf)
+    for row, source in enumerate(sources):
+        dist = out[row]
+        dist[source] = 0.0
+        heap = [(0.0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + lengths[e]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+    return out
+
+
+def reverse_csr(graph):
+    # incoming-edge adjacency, used for distances *to* a node
+    src = np.repeat(np.arange(graph.num_nodes, dtype=np.int64), np.diff(graph.indptr))
+    order = np.lexsort((src, graph.indices))
+    rev_indptr = np.zeros(graph.num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(graph.indices, minlength=graph.num_nodes), out=rev_indptr[1:])
+    return rev_indptr, src[order].astype(np.int32), np.asarray(graph.lengths)[order]
+
+
+# nearest-node index over node coordinates, built once per graph. lat/lng are
+# scaled to a local equirectangular plane, which ranks neighbours correctly
+# at city scale; without scipy it falls back to chunked brute force
+class NodeSnapper:
+    _CHUNK = 512
+
+    def __init__(self, node_lat, node_lng):
+        lat0 = float(np.mean(node_lat)) if len(node_lat) else 0.0
+        self._lng_scale = np.cos(np.radians(lat0))
+        self._points = np.column_stack([node_lat, np.asarray(node_lng) * self._lng_scale])
+        try:
+            from scipy.spatial import cKDTree
+            self._tree = cKDTree(self._points)
+        except ImportError:
+            self._tree = None
+
+    def snap_many(self, lats, lngs):
+        query = np.column_stack([np.asarray(lats, dtype=np.float64),
+                                 np.asarray(lngs, dtype=np.float64) * self._lng_scale])
+        if self._tree is not None:
+            _, idx = self._tree.query(query)
+            return np.asarray(idx, dtype=np.int64)
+
+        out = np.empty(len(query), dtype=np.int64)
+        for start in range(0, len(query), self._CHUNK):
+            chunk = query[start:start + self._CHUNK]
+            d2 = ((chunk[:, None, :] - self._points[None, :, :]) ** 2).sum(axis=2)
+            out[start:start + len(chunk)] = d2.argmin(axis=1)
+        return out
+
+
+class RoadGraph:
+    def __init__(self, node_ids, node_lat, node_lng, indptr, indices, lengths, version=None, meta=None):
+        self.node_ids = node_ids
+        self.node_lat = node_lat
+        self.node_lng = node_lng
+        self.indptr = indptr
+        self.indices = indices
+        self.lengths = lengths
+        self.meta = meta or {}
+        self.version = version or self._fingerprint()
+        self._mmap = None
+        # memoryviews index straight into the (possibly mapped) buffers and
+        # hand back plain python numbers, which keeps the search loop fast
+        self._indptr_mv = memoryview(indptr)
+        self._indices_mv = memoryview(indices)
+        self._lengths_mv = memoryview(lengths)
+        self._index_of = None
+        self._reverse = None
+        self.snapper = NodeSnapper(node_lat, node_lng)
+
+    @property
+    def num_nodes(self):
+        return len(self.node_ids)
+
+    @property
+    def num_edges(self):
+        return len(self.indices)
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name, _ in _ARRAYS)
+
+    def reverse_csr(self):
+        if self._reverse is None:
+            self._reverse = reverse_csr(self)
+        return self._reverse
+
+    def _fingerprint(self):
+        h = hashlib.sha1()
+        for name, _ in _ARRAYS:
+            h.update(np.ascontiguousarray(getattr(self, name)).tobytes())
+        return h.hexdigest()
+
+    @classmethod
+    def from_networkx(cls, G, meta=None):
+        node_ids = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+        index_of = {n: i for i, n in enumerate(node_ids.tolist())}
+        node_lat = np.array([G.nodes[n]['y'] for n in node_ids.tolist()], dtype=np.float64)
+        node_lng = np.array([G.nodes[n]['x'] for n in node_ids.tolist()], dtype=np.float64)
+
+        # parallel edges collapse to the shortest one, which is what
+        # nx.shortest_path(weight='length') uses on a MultiDiGraph anyway
+        best = {}
+        for u, v, data in G.edges(data=True):
+            key = (index_of[u], index_of[v])
+            length = float(data.get('length', 0.0))
+            if key not in best or length < best[key]:
+                best[key] = length
+
+        src = np.fromiter((k[0] for k in best), dtype=np.int64, count=len(best))
+        dst = np.fromiter((k[1] for k in best), dtype=np.int32, count=len(best))
+        lengths = np.fromiter(best.values(), dtype=np.float64, count=len(best))
+        order = np.lexsort((dst, src))
+        src, dst, lengths = src[order], dst[order], lengths[order]
+        indptr = np.zeros(len(node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=len(node_ids)), out=indptr[1:])
+        return cls(node_ids, node_lat, node_lng, indptr, dst, lengths, meta=meta)
+
+    # snapshot io
+    def save(self, path=SNAPSHOT_PATH):
+        header = {
+            "graph_version": self.version,
+            "created_at": datetime.datetime.now().isoformat(),
+            "num_nodes": self.num_nodes,
+            "num_edges": self.num_edges,
+            "meta": self.meta,
+            "arrays": [],
+        }
+        blobs = []
+        offset = 0
+        for name, dtype in _ARRAYS:
+            arr = np.ascontiguousarray(getattr(self, name), dtype=dtype)
+            header["arrays"].append({"name": name, "dtype": dtype, "count": len(arr), "offset": offset})
+            blobs.append((offset, arr))
+            offset += -(-arr.nbytes // _ALIGN) * _ALIGN
+
+        header_bytes = json.dumps(header).encode("utf-8")
+        preamble = len(SNAPSHOT_MAGIC) + 8 + len(header_bytes)
+        data_start = -(-preamble // _ALIGN) * _ALIGN
+
+        # write next to the target and rename, so workers that still map
+        # the old file keep a consistent view until they restart
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(np.array([SNAPSHOT_FORMAT, len(header_bytes)], dtype="<u4").tobytes())
+            f.write(header_bytes)
+            for rel_offset, arr in blobs:
+                f.seek(data_start + rel_offset)
+                f.write(arr.tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path=SNAPSHOT_PATH):
+        with open(path, "rb") as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if mm[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            mm.close()
+            raise ValueError(f"{path} is not a road graph snapshot")
+        pos = len(SNAPSHOT_MAGIC)
+        fmt, header_len = np.frombuffer(mm, dtype="<u4", count=2, offset=pos).tolist()
+        if fmt != SNAPSHOT_FORMAT:
+            mm.close()
+            raise ValueError(f"Unsupported snapshot format {fmt} in {path} (expected {SNAPSHOT_FORMAT})")
+        pos += 8
+        header = json.loads(mm[pos:pos + header_len].decode("utf-8"))
+        data_start = -(-(pos + header_len) // _ALIGN) * _ALIGN
+
+        arrays = {}
+        for spec in header["arrays"]:
+            arrays[spec["name"]] = np.frombuffer(
+                mm, dtype=spec["dtype"], count=spec["count"], offset=data_start + spec["offset"])
+
+        graph = cls(**arrays, version=header["graph_version"], meta=header.get("meta"))
+        graph._mmap = mm
+        return graph
+
+    # lookups
+    def node_index(self, osm_id):
+        if self._index_of is None:
+            self._index_of = {n: i for i, n in enumerate(self.node_ids.tolist())}
+        return self._index_of[osm_id]
+
+    def nearest_node(self, lat, lng):
+        return int(self.snapper.snap_many([lat], [lng])[0])
+
+    def snap_many(self, lats, lngs):
+        return self.snapper.snap_many(lats, lngs)
+
+    def shortest_path(self, source, target):
+        indptr, indices, lengths = self._indptr_mv, self._indices_mv, self._lengths_mv
+        dist = {source: 0.0}
+        prev = {}
+        heap = [(0.0, source)]
+        done = set()
+        while heap:
+            d, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            if u == target:
+                break
+            done.add(u)
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + lengths[e]
+                if nd < dist.get(v, float("inf")):
+                    dist[v] = nd
+                    prev[v] = u
+                    heapq.heappush(heap, (nd, v))
+        else:
+            raise ValueError(f"No path between node {source} and node {target}")
+
+        path = [target]
+        while path[-1] != source:
+            path.append(prev[path[-1]])
+        path.reverse()
+        return path
+
+    # network distance in meters from every source to every target (inf when
+    # unreachable). one search per node on the smaller side, run backwards
+    # over incoming edges when there are fewer targets than sources
+    def distance_matrix(self, sources, targets):
+        sources, targets = np.asarray(sources, dtype=np.int64), np.asarray(targets, dtype=np.int64)
+        if not len(sources) or not len(targets):
+            return np.zeros((len(sources), len(targets)))
+        if len(np.unique(sources)) <= len(np.unique(targets)):
+            uniq, inverse = np.unique(sources, return_inverse=True)
+            dist = dijkstra_all(self.indptr, self.indices, self.lengths, uniq.tolist())
+            return dist[inverse][:, targets]
+        uniq, inverse = np.unique(targets, return_inverse=True)
+        dist = dijkstra_all(*self.reverse_csr(), uniq.tolist())
+        return dist[inverse][:, sources].T
+
+    def edge_length(self, u, v):
+        start, end = self._indptr_mv[u], self._indptr_mv[u + 1]
+        pos = start + int(np.searchsorted(self.indices[start:end], v))
+        if pos >= end or self._indices_mv[pos] != v:
+            raise KeyError(f"No edge {u} -> {v}")
+        return self._lengths_mv[pos]
+
+    def path_length(self, path):
+        return sum(self.edge_length(u, v) for u, v in zip(path[:-1], path[1:]))
+
+    def path_coords(self, path):
+        return [(float(self.node_lat[n]), float(self.node_lng[n])) for n in path]
+
+
+# same interface as RoadGraph on top of the osmnx graph, nodes are OSM ids
+class NetworkXGraph:
+    def __init__(self, G):
+        self.G = G
+        self._version = None
+        # ox.nearest_nodes rebuilds its tree on every call, keep our own
+        self._node_ids = list(G.nodes)
+        self.snapper = NodeSnapper([G.nodes[n]['y'] for n in self._node_ids],
+                                   [G.nodes[n]['x'] for n in self._node_ids])
+
+    @property
+    def num_nodes(self):
+        return self.G.number_of_nodes()
+
+    @property
+    def num_edges(self):
+        return self.G.number_of_edges()
+
+    @property
+    def version(self):
+        if self._version is None:
+            h = hashlib.sha1()
+            for u, v, length in sorted(self.G.edges(data='length')):
+                h.update(f"{u},{v},{length};".encode())
+            self._version = h.hexdigest()
+        return self._version
+
+    def node_index(self, osm_id):
+        return osm_id
+
+    def nearest_node(self, lat, lng):
+        return self.snap_many([lat], [lng])[0]
+
+    def snap_many(self, lats, lngs):
+        return [self._node_ids[i] for i in self.snapper.snap_many(lats, lngs)]
+
+    def shortest_path(self, source, target):
+        import networkx as nx
+        return nx.shortest_path(self.G, source, target, weight='length')
+
+    def path_length(self, path):
+        import osmnx as ox
+        return sum(ox.utils_graph.get_route_edge_attributes(self.G, path, 'length'))
+
+    def path_coords(self, path):
+        return [(self.G.nodes[n]['y'], self.G.nodes[n]['x']) for n in path]
+
+    def distance_matrix(self, sources, targets):
+        import networkx as nx
+        G = self.G if len(set(sources)) <= len(set(targets)) else self.G.reverse(copy=False)
+        rows, cols = (sources, targets) if G is self.G else (targets, sources)
+        dist = {s: nx.single_source_dijkstra_path_length(G, s, weight='length') for s in set(rows)}
+        out = np.array([[dist[r].get(c, np.inf) for c in cols] for r in rows], dtype=np.float64)
+        return out if G is self.G else out.T
+
+
+def load_snapshot(path=SNAPSHOT_PATH):
+    try:
+        return RoadGraph.load(path)
+    except FileNotFoundError:
+        return None
+
+
+def load_road_graph(backend=GRAPH_BACKEND, path=SNAPSHOT_PATH, place=DEFAULT_PLACE):
+    if backend == "networkx":
+        return NetworkXGraph(download_city_graph(place))
+    if backend != "csr":
+        raise ValueError(f"Unknown graph backend '{backend}' (expected 'csr' or 'networkx')")
+
+    graph = load_snapshot(path)
+    if graph is not None:
+        return graph
+
+    # no snapshot yet: build once, write it, and map the written file so
+    # the MultiDiGraph can be garbage collected
+    print(f"No graph snapshot at {path}, building from OSM")
+    graph = RoadGraph.from_networkx(download_city_graph(place), meta={"place": place})
+    try:
+        graph.save(path)
+        return RoadGraph.load(path)
+    except Exception as e:
+        print(f"Could not write graph snapshot: {e}")
+        return graph
+
+
+# python road_graph.py build [output path] [place]
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "build":
+        print("usage: python road_graph.py build [output path] [place]")
+        sys.exit(1)
+    out_path = sys.argv[2] if len(sys.argv) > 2 else SNAPSHOT_PATH
+    place = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_PLACE
+
+    print(f"Downloading drive network for {place}...")
+    G = download_city_graph(place)
+    graph = RoadGraph.from_networkx(G, meta={"place": place})
+    graph.save(out_path)
+    print(f"Wrote {out_path}: {graph.num_nodes} nodes, {graph.num_edges} edges, version {graph.version[:12]}")
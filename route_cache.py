@@ -0,0 +1,105 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "10000"))
+# set to a file path to keep the cache warm across restarts
+ROUTE_CACHE_PATH = os.getenv("ROUTE_CACHE_PATH", "")
+
+
+# bounded LRU of computed routes keyed by (source, origin, destination),
+# where origin and destination are snapped node ids or, for remote providers,
+# coordinate strings. every entry belongs to one graph version; seeing a
+# different version drops the whole cache since snapped node ids no longer
+# line up
+class RouteCache:
+    def __init__(self, maxsize=ROUTE_CACHE_SIZE, path=ROUTE_CACHE_PATH):
+        self.maxsize = maxsize
+        self.path = path
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check_version(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    @staticmethod
+    def _key(source, origin, dest):
+        return (source,) + tuple(p if isinstance(p, str) else int(p) for p in (origin, dest))
+
+    def get(self, source, origin_node, dest_node, version):
+        key = self._key(source, origin_node, dest_node)
+        with self._lock:
+            self._check_version(version)
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, source, origin_node, dest_node, version, value):
+        key = self._key(source, origin_node, dest_node)
+        with self._lock:
+            self._check_version(version)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "graph_version": self.version,
+            }
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {
+                "graph_version": self.version,
+                "entries": [[list(key), value] for key, value in self._entries.items()],
+            }
+        tmp_path = f"{self.path}.tmp{os.getpid()}"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    # only entries built on the given graph version are kept
+    def load(self, version):
+        if not self.path:
+            return 0
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Ignoring unreadable route cache {self.path}: {e}")
+            return 0
+        with self._lock:
+            self._check_version(version)
+            if data.get("graph_version") != version:
+                return 0
+            for key, value in data.get("entries", [])[-self.maxsize:]:
+                self._entries[tuple(key)] = value
+            return len(self._entries)
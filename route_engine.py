@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+import heapq
+import random
+import numpy as np
+from road_graph import RoadGraph, SNAPSHOT_PATH, dijkstra_all
+
+# "dijkstra" searches the graph directly, "alt" runs A* with landmark
+# lower bounds (ALT) on top of a csr RoadGraph
+ROUTING_ENGINE = os.getenv("ROUTING_ENGINE", "dijkstra")
+ALT_LANDMARKS = int(os.getenv("ALT_LANDMARKS", "8"))
+ALT_ACTIVE_LANDMARKS = 4  # landmarks used per query, picked by bound at the source
+ALT_CACHE_DIR = os.getenv("ALT_CACHE_DIR", os.path.dirname(SNAPSHOT_PATH) or ".")
+
+
+class ALTEngine:
+    def __init__(self, graph, num_landmarks=ALT_LANDMARKS, cache_dir=ALT_CACHE_DIR):
+        if not isinstance(graph, RoadGraph):
+            raise ValueError("The alt routing engine needs the csr graph backend")
+        self.graph = graph
+        self.version = graph.version
+        path = os.path.join(cache_dir, f"alt-{graph.version[:12]}-{num_landmarks}.npy")
+        try:
+            # (2, k, n): [0] landmark -> node, [1] node -> landmark
+            self.tables = np.load(path, mmap_mode='r')
+        except (FileNotFoundError, ValueError):
+            self.tables = self._preprocess(num_landmarks)
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                np.save(path, self.tables)
+            except OSError as e:
+                print(f"Could not cache landmark tables: {e}")
+
+    def _preprocess(self, num_landmarks):
+        g = self.graph
+        rev = g.reverse_csr()
+        num_landmarks = min(num_landmarks, g.num_nodes)
+
+        # farthest-point selection: each new landmark is the reachable node
+        # farthest from the ones picked so far
+        landmarks = [random.Random(0).randrange(g.num_nodes)]
+        from_lm = [dijkstra_all(g.indptr, g.indices, g.lengths, landmarks[-1:])[0]]
+        nearest = from_lm[0].copy()
+        while len(landmarks) < num_landmarks:
+            candidates = np.where(np.isfinite(nearest), nearest, -1.0)
+            candidates[landmarks] = -1.0
+            landmarks.append(int(np.argmax(candidates)))
+            from_lm.append(dijkstra_all(g.indptr, g.indices, g.lengths, landmarks[-1:])[0])
+            nearest = np.minimum(nearest, from_lm[-1])
+
+        to_lm = dijkstra_all(*rev, landmarks)
+        return np.stack([np.array(from_lm), to_lm])
+
+    # (row of d(L, v), row of d(v, L), d(L, t), d(t, L)) for the landmarks
+    # with the best bound at the source. only k columns and the chosen rows
+    # are touched, so nothing here grows with the graph
+    def _active_landmarks(self, source, target):
+        from_lm, to_lm = self.tables[0], self.tables[1]
+        from_t, to_t = np.asarray(from_lm[:, target]), np.asarray(to_lm[:, target])
+        usable = np.flatnonzero(np.isfinite(from_t) & np.isfinite(to_t))
+        if not len(usable):
+            return []
+        at_source = np.maximum(from_t[usable] - from_lm[usable, source], to_lm[usable, source] - to_t[usable])
+        best = usable[np.argsort(at_source)[::-1][:ALT_ACTIVE_LANDMARKS]]
+        return [(memoryview(np.ascontiguousarray(from_lm[i])), memoryview(np.ascontiguousarray(to_lm[i])),
+                 float(from_t[i]), float(to_t[i])) for i in best]
+
+    def shortest_path(self, source, target):
+        g = self.graph
+        indptr, indices, lengths = g._indptr_mv, g._indices_mv, g._lengths_mv
+        landmarks = self._active_landmarks(source, target)
+        bounds = {}
+
+        # d(L,t) - d(L,v) and d(v,L) - d(t,L) are lower bounds on d(v,t);
+        # worked out when v is first reached and kept for the query
+        def h(v):
+            bound = bounds.get(v)
+            if bound is None:
+                bound = 0.0
+                for from_row, to_row, from_t, to_t in landmarks:
+                    bound = max(bound, from_t - from_row[v], to_row[v] - to_t)
+                bounds[v] = bound
+            return bound
+
+        inf = float("inf")
+        dist = {source: 0.0}
+        prev = {}
+        heap = [(h(source), source)]
+        done = set()
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in done:
+                continue
+            if u == target:
+                break
+            done.add(u)
+            d = dist[u]
+            for e in range(indptr[u], indptr[u + 1]):
+                v = indices[e]
+                nd = d + lengths[e]
+                if nd < dist.get(v, inf):
+                    dist[v] = nd
+                    prev[v] = u
+                    heapq.heappush(heap, (nd + h(v), v))
+        else:
+            raise ValueError(f"No path between node {source} and node {target}")
+
+        path = [target]
+        while path[-1] != source:
+            path.append(prev[path[-1]])
+        path.reverse()
+        return path
+
+
+def load_route_engine(graph, engine=ROUTING_ENGINE):
+    if engine == "dijkstra":
+        return graph
+    if engine == "alt":
+        return ALTEngine(graph)
+    raise ValueError(f"Unknown routing engine '{engine}' (expected 'dijkstra' or 'alt')")
+
+
+# compares an engine's path lengths against networkx on the same snapshot
+def verify_engine(engine, graph, samples=200, seed=0):
+    import networkx as nx
+    G = nx.DiGraph()
+    G.add_nodes_from(range(graph.num_nodes))
+    src = np.repeat(np.arange(graph.num_nodes), np.diff(graph.indptr))
+    G.add_weighted_edges_from(zip(src.tolist(), graph.indices.tolist(), graph.lengths.tolist()), weight='length')
+
+    rng = random.Random(seed)
+    checked, mismatches, engine_time = 0, [], 0.0
+    for _ in range(samples):
+        source, target = rng.randrange(graph.num_nodes), rng.randrange(graph.num_nodes)
+        try:
+            expected = nx.shortest_path_length(G, source, target, weight='length')
+        except nx.NetworkXNoPath:
+            continue
+        start = time.perf_counter()
+        path = engine.shortest_path(source, target)
+        engine_time += time.perf_counter() - start
+        got = graph.path_length(path)
+        checked += 1
+        if path[0] != source or path[-1] != target or abs(got - expected) > 1e-6 * max(1.0, expected):
+            mismatches.append((source, target, expected, got))
+
+    return {
+        "checked": checked,
+        "mismatches": mismatches,
+        "avg_query_ms": round(engine_time / checked * 1000, 3) if checked else None,
+    }
+
+
+# python route_engine.py check [engine] [samples]
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "check":
+        print("usage: python route_engine.py check [engine] [samples]")
+        sys.exit(1)
+    engine_name = sys.argv[2] if len(sys.argv) > 2 else "alt"
+    samples = int(sys.argv[3]) if len(sys.argv) > 3 else 200
+
+    graph = RoadGraph.load(SNAPSHOT_PATH)
+    engine = load_route_engine(graph, engine_name)
+    result = verify_engine(engine, graph, samples)
+    print(f"{engine_name}: {result['checked']} routes checked, {len(result['mismatches'])} mismatches, "
+          f"{result['avg_query_ms']} ms/query")
+    for source, target, expected, got in result["mismatches"][:10]:
+        print(f"  {source} -> {target}: networkx {expected:.1f} m, {engine_name} {got:.1f} m")
+    sys.exit(1 if result["mismatches"] else 0)
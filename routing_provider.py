@@ -0,0 +1,179 @@
+import os
+import numpy as np
+import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+
+# "osrm" calls an OSRM server over HTTP, "local" answers the same requests
+# in-process from the loaded road graph (no network, usable offline)
+ROUTING_PROVIDER = os.getenv("ROUTING_PROVIDER", "osrm")
+OSRM_URL = os.getenv("OSRM_URL", "http://router.project-osrm.org")
+OSRM_TIMEOUT = float(os.getenv("OSRM_TIMEOUT", "5"))
+OSRM_CONCURRENCY = int(os.getenv("OSRM_CONCURRENCY", "8"))
+OSRM_TABLE_MAX = int(os.getenv("OSRM_TABLE_MAX", "100"))  # osrm-routed --max-table-size default
+LOCAL_SPEED_MPS = 500 / 60  # ~30km/h, same as suggest_route
+LOCAL_TABLE_CHUNK = 64  # graph searches held in memory at once by table_many
+# decimals of the coordinates remote legs are cached under (~1 m)
+ROUTE_CACHE_DECIMALS = int(os.getenv("ROUTE_CACHE_DECIMALS", "5"))
+
+
+# both providers take (lat, lng) points and return an OSRM /route response:
+# {"code": "Ok", "routes": [{"duration", "distance", "geometry", "legs"}]}
+# with geojson [lng, lat] coordinates, durations in seconds and distances in
+# meters. every leg carries its own geometry so legs can be cached one by one,
+# under the cache_keys of its two endpoints
+class OSRMProvider:
+    name = "osrm"
+
+    def __init__(self, base_url=OSRM_URL, timeout=OSRM_TIMEOUT, concurrency=OSRM_CONCURRENCY):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.concurrency = concurrency
+        # keep-alive pool sized for the fan-out below
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="osrm")
+
+    def _get(self, service, points, params):
+        waypoints = ";".join(f"{lng},{lat}" for lat, lng in points)
+        url = f"{self.base_url}/{service}/v1/driving/{waypoints}"
+        return self.session.get(url, params=params, timeout=self.timeout).json()
+
+    # the server routes any coordinate, so legs are cached by the rounded
+    # request coordinates rather than by nodes of the (smaller) local graph
+    def cache_keys(self, points):
+        return [f"{lat:.{ROUTE_CACHE_DECIMALS}f},{lng:.{ROUTE_CACHE_DECIMALS}f}" for lat, lng in points]
+
+    def route(self, points):
+        resp = self._get("route", points, {"overview": "false", "geometries": "geojson", "steps": "true"})
+        for route in resp.get("routes", []):
+            for leg in route.get("legs", []):
+                # stitch the leg geometry from its steps, then drop the steps
+                coordinates = []
+                for step in leg.pop("steps", []):
+                    step_coords = step["geometry"]["coordinates"]
+                    coordinates.extend(step_coords if not coordinates else step_coords[1:])
+                leg["geometry"] = {"type": "LineString", "coordinates": coordinates}
+        return resp
+
+    # one response per point list, requests overlap on the pooled session.
+    # a failed request comes back as {"code": "Error", "message": ...}
+    def route_many(self, point_lists):
+        def safe_route(points):
+            try:
+                return self.route(points)
+            except Exception as e:
+                return {"code": "Error", "message": str(e), "routes": []}
+        return list(self._executor.map(safe_route, point_lists))
+
+    # durations in seconds, shape (len(sources), len(destinations)), inf when
+    # there is no route. split into blocks that fit the server's table size
+    def table(self, sources, destinations):
+        return self.table_many([(sources, destinations)])[0]
+
+    # one table per (sources, destinations) pair, every request of every
+    # table shares the same fan-out
+    def table_many(self, tables):
+        outs = [np.full((len(sources), len(destinations)), np.inf) for sources, destinations in tables]
+        block = max(1, OSRM_TABLE_MAX // 2)
+        jobs = [(t, i, j) for t, (sources, destinations) in enumerate(tables)
+                for i in range(0, len(sources), block) for j in range(0, len(destinations), block)]
+
+        def fetch(job):
+            t, i, j = job
+            sources, destinations = tables[t]
+            src, dst = sources[i:i + block], destinations[j:j + block]
+            params = {
+                "sources": ";".join(str(k) for k in range(len(src))),
+                "destinations": ";".join(str(len(src) + k) for k in range(len(dst))),
+                "annotations": "duration",
+            }
+            resp = self._get("table", list(src) + list(dst), params)
+            if resp.get("code") != "Ok":
+                raise ValueError(f"OSRM table error: {resp.get('message', resp.get('code'))}")
+            durations = np.array(resp["durations"], dtype=object)
+            outs[t][i:i + len(src), j:j + len(dst)] = np.where(durations == None, np.inf, durations).astype(float)
+
+        list(self._executor.map(fetch, jobs))
+        return outs
+
+
+class LocalProvider:
+    name = "local"
+
+    def __init__(self, graph, engine):
+        self.graph = graph
+        self.engine = engine
+
+    # points snapping to the same node get the same route
+    def cache_keys(self, points):
+        return [int(node) for node in self.graph.snap_many([p[0] for p in points], [p[1] for p in points])]
+
+    def route(self, points):
+        nodes = self.graph.snap_many([p[0] for p in points], [p[1] for p in points])
+        coordinates, legs = [], []
+        for origin_node, dest_node in zip(nodes, nodes[1:]):
+            try:
+                path = self.engine.shortest_path(origin_node, dest_node)
+            except Exception:
+                return {"code": "NoRoute", "message": "No route found between points", "routes": []}
+            distance = float(self.graph.path_length(path))
+            leg_coords = [[lng, lat] for lat, lng in self.graph.path_coords(path)]
+            legs.append({
+                "distance": distance,
+                "duration": distance / LOCAL_SPEED_MPS,
+                "geometry": {"type": "LineString", "coordinates": leg_coords},
+            })
+            coordinates.extend(leg_coords if not coordinates else leg_coords[1:])
+
+        distance = sum(leg["distance"] for leg in legs)
+        return {
+            "code": "Ok",
+            "routes": [{
+                "distance": distance,
+                "duration": sum(leg["duration"] for leg in legs),
+                "geometry": {"type": "LineString", "coordinates": coordinates},
+                "legs": legs,
+            }],
+        }
+
+    # searches are CPU bound, threads would only contend on the GIL
+    def route_many(self, point_lists):
+        return [self.route(points) for points in point_lists]
+
+    def table(self, sources, destinations):
+        return self.table_many([(sources, destinations)])[0]
+
+    # one search per distinct node on the smaller side over all tables, run
+    # LOCAL_TABLE_CHUNK at a time so only that many full graph rows are held
+    def table_many(self, tables):
+        points = [p for sources, destinations in tables for p in list(sources) + list(destinations)]
+        if not points:
+            return [np.zeros((len(sources), len(destinations))) for sources, destinations in tables]
+        nodes = np.asarray(self.graph.snap_many([p[0] for p in points], [p[1] for p in points]), dtype=np.int64)
+        src_nodes, dst_nodes, pos = [], [], 0
+        for sources, destinations in tables:
+            src_nodes.append(nodes[pos:pos + len(sources)])
+            dst_nodes.append(nodes[pos + len(sources):pos + len(sources) + len(destinations)])
+            pos += len(sources) + len(destinations)
+        uniq_src, uniq_dst = np.unique(np.concatenate(src_nodes)), np.unique(np.concatenate(dst_nodes))
+
+        dist = np.empty((len(uniq_src), len(uniq_dst)))
+        if len(uniq_src) <= len(uniq_dst):
+            for i in range(0, len(uniq_src), LOCAL_TABLE_CHUNK):
+                dist[i:i + LOCAL_TABLE_CHUNK] = self.graph.distance_matrix(uniq_src[i:i + LOCAL_TABLE_CHUNK], uniq_dst)
+        else:
+            for j in range(0, len(uniq_dst), LOCAL_TABLE_CHUNK):
+                dist[:, j:j + LOCAL_TABLE_CHUNK] = self.graph.distance_matrix(uniq_src, uniq_dst[j:j + LOCAL_TABLE_CHUNK])
+        return [dist[np.ix_(np.searchsorted(uniq_src, src), np.searchsorted(uniq_dst, dst))] / LOCAL_SPEED_MPS
+                for src, dst in zip(src_nodes, dst_nodes)]
+
+
+def load_routing_provider(graph, engine, provider=ROUTING_PROVIDER):
+    if provider == "osrm":
+        return OSRMProvider()
+    if provider == "local":
+        return LocalProvider(graph, engine)
+    raise ValueError(f"Unknown routing provider '{provider}' (expected 'osrm' or 'local')")
@@ -0,0 +1,179 @@
+import os
+import time
+import math
+import numpy as np
+
+# most orders a driver carries at once
+TOUR_CAPACITY = int(os.getenv("TOUR_CAPACITY", "3"))
+# most orders in one tour, keeps the last dropoffs from waiting too long
+TOUR_MAX_ORDERS = int(os.getenv("TOUR_MAX_ORDERS", "5"))
+# longest tour, in minutes of driving from the driver's position
+TOUR_MAX_MINUTES = float(os.getenv("TOUR_MAX_MINUTES", "120"))
+# minutes charged for putting one more driver on the road, favours bundling
+TOUR_VEHICLE_COST = float(os.getenv("TOUR_VEHICLE_COST", "10"))
+# wall-clock budget for one plan, construction and local search together
+TOUR_TIME_BUDGET_SECONDS = float(os.getenv("TOUR_TIME_BUDGET_SECONDS", "1.0"))
+
+
+# pickup-and-delivery tours: cheapest insertion to build them, then relocate
+# and 2-opt moves until nothing improves or the time budget runs out.
+# times is a square matrix of minutes over nodes laid out as drivers
+# 0..R-1, pickups R..R+D-1 and dropoffs R+D..R+2D-1. candidates[k] lists
+# the drivers delivery k may go to; entries insertion never reads may be
+# left inf. routes are open (no return to start)
+class TourPlanner:
+    def __init__(self, times, num_drivers, num_deliveries, candidates, capacity=TOUR_CAPACITY,
+                 max_orders=TOUR_MAX_ORDERS, max_minutes=TOUR_MAX_MINUTES, vehicle_cost=TOUR_VEHICLE_COST):
+        self.times = np.ascontiguousarray(times, dtype=np.float64)
+        self._times_mv = memoryview(self.times)  # cheap scalar reads in the inner loops
+        self.num_drivers = num_drivers
+        self.num_deliveries = num_deliveries
+        self.candidates = candidates
+        self.capacity = capacity
+        self.max_orders = max_orders
+        self.max_minutes = max_minutes
+        self.vehicle_cost = vehicle_cost
+        self.routes = [[] for _ in range(num_drivers)]
+        self.costs = [0.0] * num_drivers
+        self.route_of = [None] * num_deliveries
+        self.moves = 0
+
+    def pickup(self, k):
+        return self.num_drivers + k
+
+    def dropoff(self, k):
+        return self.num_drivers + self.num_deliveries + k
+
+    def delivery(self, node):
+        return (node - self.num_drivers) % self.num_deliveries
+
+    def is_pickup(self, node):
+        return node < self.num_drivers + self.num_deliveries
+
+    # minutes of driving plus the vehicle cost, inf if the stop order breaks
+    # capacity, pickup-before-dropoff or the tour size and length limits
+    def route_cost(self, driver, stops):
+        if not stops:
+            return 0.0
+        if len(stops) > 2 * self.max_orders:
+            return math.inf
+        elapsed, prev, onboard = 0.0, driver, set()
+        for node in stops:
+            elapsed += self._times_mv[prev, node]
+            if self.is_pickup(node):
+                onboard.add(node)
+                if len(onboard) > self.capacity:
+                    return math.inf
+            else:
+                pickup = self.pickup(self.delivery(node))
+                if pickup not in onboard:
+                    return math.inf
+                onboard.discard(pickup)
+            prev = node
+        if elapsed > self.max_minutes:
+            return math.inf
+        return elapsed + self.vehicle_cost
+
+    # minutes from the driver's start at which every stop is reached
+    def arrival_times(self, driver):
+        elapsed, prev, out = 0.0, driver, []
+        for node in self.routes[driver]:
+            elapsed += self._times_mv[prev, node]
+            out.append(elapsed)
+            prev = node
+        return out
+
+    # cheapest (added cost, driver, stops) for delivery k among its candidates
+    def best_insertion(self, k):
+        pickup, dropoff = self.pickup(k), self.dropoff(k)
+        best = (math.inf, None, None)
+        for driver in self.candidates[k]:
+            stops, base = self.routes[driver], self.costs[driver]
+            for i in range(len(stops) + 1):
+                with_pickup = stops[:i] + [pickup] + stops[i:]
+                for j in range(i + 1, len(with_pickup) + 1):
+                    candidate = with_pickup[:j] + [dropoff] + with_pickup[j:]
+                    delta = self.route_cost(driver, candidate) - base
+                    if delta < best[0]:
+                        best = (delta, driver, candidate)
+        return best
+
+    def _apply(self, driver, stops):
+        self.routes[driver] = stops
+        self.costs[driver] = self.route_cost(driver, stops)
+        for node in stops:
+            if self.is_pickup(node):
+                self.route_of[self.delivery(node)] = driver
+
+    def _remove(self, k):
+        driver = self.route_of[k]
+        stops = [n for n in self.routes[driver] if n not in (self.pickup(k), self.dropoff(k))]
+        self.route_of[k] = None
+        self._apply(driver, stops)
+        return driver
+
+    # deliveries not reached before the deadline stay unassigned
+    def construct(self, order=None, deadline=None):
+        for k in (order if order is not None else range(self.num_deliveries)):
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            delta, driver, stops = self.best_insertion(k)
+            if driver is not None and delta < math.inf:
+                self._apply(driver, stops)
+
+    # move one delivery (its pickup and dropoff) to its cheapest position in
+    # any candidate tour, including its own
+    def relocate(self, k):
+        driver = self.route_of[k]
+        old_stops, old_cost = self.routes[driver], self.costs[driver]
+        self._remove(k)
+        saved = old_cost - self.costs[driver]
+        delta, new_driver, stops = self.best_insertion(k)
+        if new_driver is not None and delta < saved - 1e-9:
+            self._apply(new_driver, stops)
+            return True
+        self.routes[driver], self.costs[driver] = old_stops, old_cost
+        self.route_of[k] = driver
+        return False
+
+    # reverse a stretch of stops inside one tour
+    def two_opt(self, driver):
+        stops = self.routes[driver]
+        for i in range(len(stops) - 1):
+            for j in range(i + 1, len(stops)):
+                candidate = stops[:i] + stops[i:j + 1][::-1] + stops[j + 1:]
+                cost = self.route_cost(driver, candidate)
+                if cost < self.costs[driver] - 1e-9:
+                    self._apply(driver, candidate)
+                    return True
+        return False
+
+    def improve(self, budget_seconds=TOUR_TIME_BUDGET_SECONDS):
+        deadline = time.monotonic() + budget_seconds
+        improved = True
+        while improved and time.monotonic() < deadline:
+            improved = False
+            for k in range(self.num_deliveries):
+                if time.monotonic() >= deadline:
+                    break
+                if self.route_of[k] is not None and self.relocate(k):
+                    self.moves += 1
+                    improved = True
+            for driver in range(self.num_drivers):
+                if time.monotonic() >= deadline:
+                    break
+                while self.two_opt(driver):
+                    self.moves += 1
+                    improved = True
+
+    def plan(self, budget_seconds=TOUR_TIME_BUDGET_SECONDS):
+        deadline = time.monotonic() + budget_seconds
+        self.construct(deadline=deadline)
+        self.improve(max(0.0, deadline - time.monotonic()))
+        return self.routes
+
+    def total_cost(self):
+        return sum(self.costs)
+
+    def unassigned(self):
+        return [k for k, driver in enumerate(self.route_of) if driver is None]
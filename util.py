@@ -1,7 +1,7 @@
 import math 
 import datetime
-import joblib
-import pandas as pd
+import numpy as np
+from eta_infer import load_eta_model, CompiledETAModel, FEATURES
 
 def haversine(lat1, lon1, lat2, lon2):
     R = 6371  # Radius of the Earth in kilometers
@@ -11,19 +11,34 @@ def haversine(lat1, lon1, lat2, lon2):
     a= math.sin(dphi/2)**2 + math.cos(ph1)*math.cos(ph2)*math.sin(dlambda/2)**2
     return 2 * R * math.asin(math.sqrt(a))
 
-# model
-model= joblib.load('model/delivery_eta_lr.pkl')
+# vectorized haversine over arrays of coordinates, in kilometers
+def haversine_many(lat1, lon1, lat2, lon2):
+    R = 6371
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(a, dtype=np.float64)) for a in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * R * np.arcsin(np.sqrt(a))
+
+# model (numpy-only export from eta_export.py, pickled sklearn model if missing)
+model= load_eta_model()
+
+# ETA in minutes for many legs with a single predict call
+def predict_eta_batch(origin_lats, origin_lngs, dest_lats, dest_lngs, model=model, now=None):
+    distance = haversine_many(origin_lats, origin_lngs, dest_lats, dest_lngs)
+    if not len(distance):
+        return np.zeros(0)
+    now = now or datetime.datetime.now()
+    features = np.column_stack([
+        distance,
+        np.full(len(distance), now.hour),
+        np.full(len(distance), now.weekday())
+    ])
+    if not isinstance(model, CompiledETAModel):
+        import pandas as pd
+        features = pd.DataFrame(features, columns=list(FEATURES))
+    return np.maximum(0.0, model.predict(features))  # Ensure non-negative ETA
 
 def get_eta_minutes(current_lat, current_lng, dropoff_lat, dropoff_lng, model=model):
-    distance= haversine(current_lat, current_lng, dropoff_lat, dropoff_lng)
-    now= datetime.datetime.now()
-    features = pd.DataFrame([{
-        'distance_km': distance,
-        'hour': now.hour,
-        'weekday': now.weekday()
-    }])
-    eta_minutes= model.predict(features)[0]
-    return max(0.0, float(eta_minutes))  # Ensure non-negative ETA
+    return float(predict_eta_batch([current_lat], [current_lng], [dropoff_lat], [dropoff_lng], model)[0])
 
 # driver = {
 #     'driver_lat': 14.5547,